@@ -0,0 +1,102 @@
+# Purpose: Combine the date vector and the single-column cost733class output of all ensemble
+#          members into one matrix file, replacing the manual console command
+#              paste date.dat z500_extended_* >cost_CESM12-LE_historical_1960-2099_Z500.dat
+#          (1) read all member files in parallel
+#          (2) check that every member has exactly as many days as the date vector, so that
+#              a missing leap day or a truncated file stops here and not later in R
+#          (3) write the combined matrix in one pass (same layout as the paste output)
+#          (4) write a sidecar file '<output>.members' with the member names in column order
+#          usage: python assemble_ensemble.py date.dat output.dat member_1.dat member_2.dat ...
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import re # package to extract a part of the filename
+import sys
+from concurrent.futures import ThreadPoolExecutor # read member files in parallel
+from datetime import datetime # package for stopping time
+
+# e.g. z500_extended_CESM12-LE_historical_r12i1p1_1940-2099_Z500.dat -> CESM12-LE_r12i1p1
+#      zg_day_GFDL-ESM2M_historical_rcp85_r1i1p1_cost.dat          -> GFDL-ESM2M_r1i1p1
+member_pattern = re.compile(r'([A-Za-z0-9.\-]+)_historical(?:_rcp85)?_(r\d+i\d+p\d+)')
+
+
+def member_name(filename):
+    """Member name (model_realisation) from a cost733class output file name."""
+    name = os.path.basename(filename)
+    match = member_pattern.search(name)
+    if match is None:
+        return os.path.splitext(name)[0] # fall back to the file name without extension
+    return match.group(1) + '_' + match.group(2)
+
+
+def natural_key(name):
+    """Sort key comparing numbers numerically, i.e. r2i1p1 before r10i1p1."""
+    return [int(s) if s.isdigit() else s.lower() for s in re.split(r'(\d+)', name)]
+
+
+def read_lines(filename):
+    """All lines of a file without line endings (a trailing empty line is dropped)."""
+    with open(filename, 'rb') as f:
+        return f.read().splitlines()
+
+
+def assemble(date_file, member_files, output, names=None, workers=8):
+    """Write the date vector and all member columns into one tab separated matrix.
+
+    member_files -> list of single-column cost733class outputs (e.g. z500_extended_*)
+    names        -> member names in the same order; by default taken from the file names
+    The columns are sorted by member name (numbers compared numerically) so the column
+    order no longer depends on the shell glob order. Returns the member names in column
+    order, which are also written to output + '.members'.
+    """
+    if names is None:
+        names = [member_name(f) for f in member_files]
+    if len(names) != len(member_files):
+        raise ValueError('got ' + str(len(names)) + ' names for ' +
+                         str(len(member_files)) + ' member files')
+    if len(set(names)) != len(names):
+        raise ValueError('member names are not unique: ' + ', '.join(names))
+
+    order = sorted(range(len(names)), key=lambda i: natural_key(names[i]))
+    names = [names[i] for i in order]
+    member_files = [member_files[i] for i in order]
+
+    # (1) read date vector and all members in parallel
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        dates = pool.submit(read_lines, date_file)
+        columns = list(pool.map(read_lines, member_files))
+    dates = dates.result()
+
+    # (2) check length of every member against the date vector
+    wrong = [names[i] + ' (' + str(len(c)) + ' days)' for i, c in enumerate(columns)
+             if len(c) != len(dates)]
+    if wrong:
+        raise ValueError('length does not match the ' + str(len(dates)) + ' days of ' +
+                         date_file + ': ' + ', '.join(wrong))
+
+    # (3) write combined matrix in one pass, i.e. the same as 'paste date.dat member_*'
+    with open(output, 'wb') as f:
+        for row in zip(dates, *columns):
+            f.write(b'\t'.join(row) + b'\n')
+
+    # (4) sidecar with member names in column order
+    with open(output + '.members', 'w') as f:
+        f.write('\n'.join(names) + '\n')
+    return names
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        sys.exit('usage: python assemble_ensemble.py date.dat output.dat member_files...')
+    starttime = datetime.now() # start stopwatch
+    names = assemble(sys.argv[1], sys.argv[3:], sys.argv[2])
+    print(str(len(names)) + ' members written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
@@ -0,0 +1,177 @@
+# Purpose: Block bootstrap significance test of the future - past change in frequency and
+#          persistence of the circulation types for every member, type and season
+#          (1) precompute per member and year the seasonal counts and run-length histograms
+#              (runs cut at the edges of the two periods and counted in the year they start)
+#          (2) null hypothesis 'no change': the years of both periods are pooled and two
+#              samples of 30 years are drawn with replacement (a year is one block, so runs
+#              within a season stay intact); a sample is a vector of how often each year was
+#              drawn, so the sums over a sample are one matrix product with the precomputed
+#              arrays instead of a recount of the days
+#          (3) change of the mean annual counts (Fig. 2) and of the persistence measure, i.e.
+#              the slope of the run-length distribution (Fig. 1, persistence_fit.py)
+#          (4) the resamples are split into batches with independent seeds (SeedSequence.spawn)
+#              and spread over a process pool; every batch only returns exceedance counts
+#              (and the null distribution if requested)
+#          usage: python bootstrap.py cost_..._Z500.dat output.npz [n_resamples] [n_workers]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+import frequency
+import persistence
+import persistence_fit
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import period_slices, periods
+
+seed = 2018 # same seed as the leap day insertion
+batch_size = 100 # resamples per batch (memory: members x batch x types x seasons x lengths)
+max_length = 20 # run-length bins, the last one collects the longer runs
+
+_data = None # precomputed yearly statistics in the worker processes
+
+
+def yearly_statistics(types, dates, n_types=None, max_length=max_length, calendar='gregorian',
+                      years=(periods['past'], periods['future'])):
+    """Counts (member, year, season, type) and histograms (member, year, type, season, length).
+
+    The year axis covers all years of the periods (in their order), runs are cut at the
+    edges of every period as in persistence.period_histograms(). Also returns the year
+    numbers and the index of every period's years on the year axis.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        n_types = int(types[types != missing].max(initial=0))
+    all_years = np.concatenate([np.arange(y[0], y[1] + 1) for y in years])
+    counts, histograms, index = [], [], []
+    for y, rows in zip(years, period_slices(dates, years)):
+        counts.append(frequency.annual_counts(types[rows], dates[rows], n_types, y)[0])
+        runs = persistence.find_runs(types[rows], dates[rows], calendar)
+        histograms.append(persistence.yearly_histogram(runs, types.shape[1], n_types, y,
+                                                       max_length))
+        first = sum(len(i) for i in index)
+        index.append(np.arange(first, first + y[1] - y[0] + 1))
+    return (np.concatenate(counts, axis=1), np.concatenate(histograms, axis=1), all_years,
+            index)
+
+
+def sample_weights(rng, n_resamples, pool, n_draws, n_years):
+    """How often every year is drawn, (n_resamples, n_years), drawing n_draws from pool."""
+    draws = pool[rng.integers(0, len(pool), size=(n_resamples, n_draws))]
+    offset = np.arange(n_resamples)[:, None] * n_years
+    return np.bincount((draws + offset).ravel(),
+                       minlength=n_resamples * n_years).reshape(n_resamples, n_years)
+
+
+def changes(counts, histograms, weights_past, weights_future):
+    """Frequency and persistence change for year weights (n_resamples, n_years).
+
+    Returns the change of the mean annual counts (resample, member, season, type) and of the
+    persistence measure (resample, member, type, season).
+    """
+    n_members, n_years = counts.shape[:2]
+    flat = counts.reshape(n_members, n_years, -1).astype(float)
+    hist = histograms.reshape(n_members, n_years, -1).astype(float)
+    results = []
+    for w in (weights_past, weights_future):
+        w = w.astype(float)
+        mean = np.einsum('ry,myk->rmk', w / w.sum(axis=1, keepdims=True), flat)
+        summed = np.einsum('ry,myk->rmk', w, hist).reshape((len(w), n_members) +
+                                                            histograms.shape[2:])
+        slope = persistence_fit.fit(summed, overflow=True)['slope']
+        results.append((mean.reshape((len(w), n_members) + counts.shape[2:]), slope))
+    return results[1][0] - results[0][0], results[1][1] - results[0][1]
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _batch(task):
+    """Null distribution of one batch of resamples -> exceedance counts (and distribution)."""
+    seed_sequence, n_resamples, keep = task
+    counts, histograms, index, observed = _data
+    rng = np.random.default_rng(seed_sequence)
+    pool = np.concatenate(index)
+    n_years = counts.shape[1]
+    w_past = sample_weights(rng, n_resamples, pool, len(index[0]), n_years)
+    w_future = sample_weights(rng, n_resamples, pool, len(index[-1]), n_years)
+    null = changes(counts, histograms, w_past, w_future)
+    out = []
+    for n, o in zip(null, observed):
+        exceed = (np.abs(n) >= np.abs(o)[None]).sum(axis=0)
+        valid = np.isfinite(n).sum(axis=0)
+        out.append((exceed, valid, n.astype(np.float32) if keep else None))
+    return out
+
+
+def bootstrap(types, dates, n_types=None, n_resamples=10000, n_workers=None, seed=seed,
+              keep_distribution=False, calendar='gregorian',
+              years=(periods['past'], periods['future'])):
+    """Block bootstrap p-values of the frequency and persistence change of all members.
+
+    Returns a dict with the observed changes, the p-values (two-sided, (1 + number of
+    resamples at least as extreme) / (1 + number of valid resamples)) and with
+    keep_distribution=True the null distributions (resample, ...):
+        frequency_change, frequency_pvalue   -> (member, season, type)
+        persistence_change, persistence_pvalue -> (member, type, season)
+    """
+    counts, histograms, all_years, index = yearly_statistics(types, dates, n_types,
+                                                             max_length, calendar, years)
+    n_years = len(all_years)
+    w = [np.bincount(i, minlength=n_years)[None] for i in index]
+    observed = [o[0] for o in changes(counts, histograms, w[0], w[-1])]
+
+    sizes = [batch_size] * (n_resamples // batch_size)
+    if n_resamples % batch_size:
+        sizes.append(n_resamples % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes)) # independent stream per batch
+    tasks = [(s, n, keep_distribution) for s, n in zip(seeds, sizes)]
+    data = (counts, histograms, index, observed)
+    if n_workers == 1:
+        _init_worker(data)
+        batches = [_batch(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(n_workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(data,)) as pool:
+            batches = list(pool.map(_batch, tasks))
+
+    result = {}
+    for k, name in enumerate(('frequency', 'persistence')):
+        exceed = sum(b[k][0] for b in batches)
+        valid = sum(b[k][1] for b in batches)
+        result[name + '_change'] = observed[k]
+        with np.errstate(invalid='ignore'):
+            result[name + '_pvalue'] = np.where(np.isfinite(observed[k]),
+                                                (1. + exceed) / (1. + valid), np.nan)
+        if keep_distribution:
+            result[name + '_null'] = np.concatenate([b[k][2] for b in batches])
+    return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python bootstrap.py cost_matrix.dat output.npz [n_resamples] '
+                 '[n_workers]')
+    starttime = datetime.now() # start stopwatch
+    n_resamples = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    n_workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    dates, types, names = cost_parser.read(sys.argv[1])
+    result = bootstrap(types, dates, n_resamples=n_resamples, n_workers=n_workers)
+    np.savez(sys.argv[2], members=names, n_resamples=n_resamples, seed=seed, **result)
+    print(str(n_resamples) + ' resamples written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
@@ -0,0 +1,201 @@
+# Purpose: Map daily model output with a 365_day (noleap) or 360_day calendar onto the
+#          Gregorian date vector data/date.dat with whole-array NumPy operations
+#          (1) read the model calendar from the time attributes of the NetCDF file
+#          (2) decide for every real calendar year how many days are missing in the model,
+#              i.e. 1 day in leap years for 365_day models and 5 or 6 days for 360_day models
+#          (3) place these padding days either deterministically (29. February for 365_day,
+#              evenly spread over the year for 360_day) or randomly within the year as in
+#              leap_days.py and fill them with NaN
+#          (4) convert all ensemble members in one call instead of file by file
+#          (5) convert_files reads the single-column cost733class outputs ('small' files) of
+#              all members and writes the extended files ('nan' on the padded days), used by
+#              leap_day_cmip5.py and leap_day_cesm.py
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+
+# calendar names as they appear in the time@calendar attribute of the model output
+calendar_aliases = {'gregorian': 'gregorian', 'standard': 'gregorian',
+                    'proleptic_gregorian': 'gregorian', 'julian': 'gregorian',
+                    'noleap': '365_day', '365_day': '365_day',
+                    '360_day': '360_day'}
+days_per_year = {'365_day': 365, '360_day': 360}
+policies = ('fixed', 'random')
+
+# seasons in the order of the R scripts, i.e. l = 1 (spring) ... l = 4 (winter); December
+# belongs to winter (cut(..., 'month') + 32 and quarters() in the R scripts)
+seasons = ('spring', 'summer', 'fall', 'winter')
+season_months = {'spring': (3, 4, 5), 'summer': (6, 7, 8), 'fall': (9, 10, 11),
+                 'winter': (12, 1, 2)}
+
+
+def read_date_vector(filename='data/date.dat'):
+    """Read a YYYY MM DD date vector (integer or scientific notation) as int array (n, 3)."""
+    return cost_parser.read(filename)[0]
+
+
+def normalise_calendar(calendar):
+    """Map a CF calendar name onto 'gregorian', '365_day' or '360_day'."""
+    if calendar is None:
+        return 'gregorian' # the CF default if the attribute is missing
+    try:
+        return calendar_aliases[calendar.strip().lower()]
+    except KeyError:
+        raise ValueError('unsupported calendar: ' + str(calendar))
+
+
+def read_calendar(filename, time_name='time'):
+    """Read the calendar of a NetCDF file from its time@calendar attribute."""
+    from netCDF4 import Dataset
+    with Dataset(filename) as nc:
+        return normalise_calendar(getattr(nc.variables[time_name], 'calendar', None))
+
+
+def season_of_month(month):
+    """Season index (0 = spring, ..., 3 = winter) of an array of months."""
+    return ((np.asarray(month) + 9) // 3) % 4
+
+
+def year_blocks(dates):
+    """First row and number of rows of every calendar year in the date vector."""
+    years = dates[:, 0]
+    start = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    length = np.diff(np.r_[start, len(years)])
+    return years[start], start, length
+
+
+def padding_mask(dates, calendar, policy='fixed', n_members=1, seed=None):
+    """Boolean array (n_days, n_members), True for Gregorian days missing in the model.
+
+    policy = 'fixed'  -> same padding days for all members: 29. February for 365_day
+                         models, evenly spaced days within the year for 360_day models
+    policy = 'random' -> random padding days within every year, drawn independently for
+                         each member (never the 1. January, as in leap_days.py)
+    """
+    calendar = normalise_calendar(calendar)
+    if policy not in policies:
+        raise ValueError('unknown padding policy: ' + str(policy))
+    n_days = len(dates)
+    if calendar == 'gregorian':
+        return np.zeros((n_days, n_members), dtype=bool)
+
+    _, start, length = year_blocks(dates)
+    n_pad = length - days_per_year[calendar] # missing days in each year
+    if np.any(n_pad < 0):
+        raise ValueError('date vector has incomplete years, cannot pad to ' + calendar)
+
+    mask = np.zeros((n_days, n_members), dtype=bool)
+    if policy == 'fixed' and calendar == '365_day':
+        mask[(dates[:, 1] == 2) & (dates[:, 2] == 29), :] = True
+    elif policy == 'fixed':
+        # spread the missing days evenly, e.g. every 73rd day for 5 missing days
+        year = np.repeat(np.arange(len(start)), n_pad)
+        k = np.arange(len(year)) - np.repeat(np.cumsum(n_pad) - n_pad, n_pad)
+        offset = ((k + 0.5) * length[year] / n_pad[year]).astype(np.int64)
+        mask[start[year] + offset, :] = True
+    else:
+        # random keys for every day of the year, the n_pad smallest keys are padded;
+        # the 1. January and days beyond the end of the year get an infinite key
+        rng = np.random.default_rng(seed)
+        day = np.arange(length.max())
+        keys = rng.random((len(start), n_members, len(day)))
+        excluded = (day[None, :] == 0) | (day[None, :] >= length[:, None]) # (year, day)
+        keys[np.broadcast_to(excluded[:, None, :], keys.shape)] = np.inf
+        rank = np.argsort(np.argsort(keys, axis=2), axis=2)
+        chosen = rank < n_pad[:, None, None] # (year, member, day of year)
+        year, member, offset = np.nonzero(chosen)
+        mask[start[year] + offset, member] = True
+    return mask
+
+
+def to_gregorian(data, calendar, dates, policy='fixed', seed=None):
+    """Map model data (n_model_days, n_members) onto the Gregorian date vector.
+
+    Returns a float array (n_days, n_members) with NaN on the padded days. A 1D input
+    is treated as a single member and a 1D array is returned.
+    """
+    data = np.asarray(data, dtype=float)
+    squeeze = data.ndim == 1
+    if squeeze:
+        data = data[:, None]
+
+    mask = padding_mask(dates, calendar, policy, data.shape[1], seed)
+    n_model = (~mask).sum(axis=0)
+    if np.any(n_model != data.shape[0]):
+        raise ValueError('model series has ' + str(data.shape[0]) + ' days, the ' +
+                         normalise_calendar(calendar) + ' calendar needs ' +
+                         str(n_model[0]) + ' days for this date vector')
+
+    # row of the model data for every Gregorian day, -1 for padded days
+    source = np.cumsum(~mask, axis=0) - 1
+    out = np.take_along_axis(data, np.maximum(source, 0), axis=0)
+    out[mask] = np.nan
+    return out[:, 0] if squeeze else out
+
+
+def convert_members(columns, calendars, dates, policy='fixed', seed=None):
+    """Convert many members with possibly different calendars in one call.
+
+    columns   -> list of 1D model series (one per member)
+    calendars -> list of calendar names (e.g. from read_calendar()) of the same length
+    Members sharing a calendar are converted together; the result is (n_days, n_members)
+    in the order of the input columns.
+    """
+    calendars = [normalise_calendar(c) for c in calendars]
+    out = np.full((len(dates), len(columns)), np.nan)
+    rng = np.random.default_rng(seed)
+    for calendar in sorted(set(calendars)):
+        index = [i for i, c in enumerate(calendars) if c == calendar]
+        block = np.column_stack([np.asarray(columns[i], dtype=float) for i in index])
+        out[:, index] = to_gregorian(block, calendar, dates, policy, rng)
+    return out
+
+
+def read_member(filename):
+    """Single-column circulation type series of one member ('nan' as NaN)."""
+    return np.loadtxt(filename, ndmin=1)
+
+
+def write_member(filename, series):
+    """Write a series as one type per line, 'nan' on the padded days (as leap_days.py)."""
+    series = np.asarray(series)
+    lines = np.where(np.isnan(series), 'nan', np.nan_to_num(series).astype(np.int64).astype(str))
+    with open(filename + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(filename + '.tmp', filename)
+
+
+def convert_files(filenames, calendars, path_in, dates, path_out=None, policy='fixed',
+                  seed=None, replace=('small', 'extended')):
+    """Map the cost733class outputs of all members (e.g. 'small' files) onto the date vector
+    in one call and write the extended files.
+
+    calendars -> calendar of every file (e.g. read_calendar() of the model data)
+    The output file name is the input file name with replace[0] substituted by replace[1];
+    files without replace[0] in their name get the suffix '_extended' instead. Returns the
+    output file names.
+    """
+    if path_out is None:
+        path_out = path_in
+    columns = [read_member(os.path.join(path_in, f)) for f in filenames]
+    data = convert_members(columns, calendars, dates, policy, seed)
+    out_names = []
+    for j, f in enumerate(filenames):
+        out_name = f.replace(replace[0], replace[1]) if replace[0] in f else \
+                   f[:-4] + '_' + replace[1] + f[-4:]
+        if os.path.abspath(os.path.join(path_in, f)) == \
+           os.path.abspath(os.path.join(path_out, out_name)):
+            raise ValueError('input and output file are the same: ' + f)
+        write_member(os.path.join(path_out, out_name), data[:, j])
+        out_names.append(out_name)
+    return out_names
@@ -0,0 +1,156 @@
+# Purpose: Planner for the cdo operator chains of preprocessing_cmip5_maps_data.py, which
+#          reorders a declarative chain so the data is reduced as early as possible, e.g.
+#          selyear,1988/2017 -> sellevel,50000 -> setlevel,0 -> remapbil,grid.nc ->
+#          sellonlatbox,-20,40,30,80 (global fields of all levels interpolated) becomes
+#          selyear -> sellevel -> sellonlatbox,<padded> -> setlevel -> remapbil -> sellonlatbox
+#          (1) a chain is a list of (operator, arguments) in the order of application
+#          (2) time and field selections (selyear, sellevel, selname, ...) are moved in front of
+#              the horizontal operators (remapping, sellonlatbox); they do not move past
+#              operators which change levels or names (setlevel, chname, ...) or past any
+#              operator the planner does not know (e.g. yseasavg), which ends a segment
+#          (3) a remapping followed by sellonlatbox gets a pre-crop to the box padded by a few
+#              source grid cells, so the interpolation only sees the points it needs
+#          (4) the leading selections (years, level, box) can be read directly from the model
+#              files with virtual_dataset.py (split), the rest runs as one cdo command
+#          (5) a plan is only used after both chains gave the same result on a sample of the
+#              data (equivalent), time selections left out as the sample has a few time steps
+#          usage: from a script, plan(chain, resolution(lon, lat)), equivalent(chain, plan,
+#                 sample, workdir) and run(chain, input, output)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import subprocess
+import numpy as np # package for calculations
+from netCDF4 import Dataset
+
+time_selections = ('selyear', 'selmon', 'selseason', 'seldate', 'seltimestep')
+field_selections = ('sellevel', 'selname', 'selvar', 'selcode')
+field_changes = ('setlevel', 'setname', 'chname', 'setunit', 'setcode') # pointwise in space
+remappings = ('remapbil', 'remapbic', 'remapnn', 'remapdis', 'remapcon', 'remapcon2')
+crop = 'sellonlatbox'
+pad_cells = 2 # source grid cells added on every side of the pre-crop box
+
+
+def resolution(lon, lat):
+    """Largest grid spacing in degrees of a lon/lat grid."""
+    return float(max(np.abs(np.diff(lon)).max(), np.abs(np.diff(lat)).max()))
+
+
+def padded(box, pad):
+    """sellonlatbox arguments of a box widened by pad degrees, None if that is global."""
+    lon_min, lon_max, lat_min, lat_max = [float(x) for x in box.split(',')]
+    if lon_max - lon_min + 2 * pad >= 360:
+        return None
+    return ','.join('%g' % x for x in (lon_min - pad, lon_max + pad, max(lat_min - pad, -90),
+                                       min(lat_max + pad, 90)))
+
+
+def reorder(segment, pad):
+    """Cheaper order of a chain segment of known operators."""
+    spatial = [op for op in segment if op[0] == crop or op[0] in remappings]
+    other = [op for op in segment if op[0] != crop and op[0] not in remappings]
+
+    # pre-crop in front of the first remapping which is followed by a crop
+    remap = [i for i, op in enumerate(spatial) if op[0] in remappings]
+    if remap and pad is not None:
+        after = [op for op in spatial[remap[0]:] if op[0] == crop]
+        box = padded(after[0][1], pad) if after else None
+        if box is not None:
+            spatial.insert(remap[0], (crop, box))
+
+    # selections before the first field change, then the crops before the first remapping,
+    # then the remaining field selections and changes (in their order) and the rest
+    n_selections = next((i for i, op in enumerate(other) if op[0] in field_changes), len(other))
+    n_crops = next((i for i, op in enumerate(spatial) if op[0] in remappings), len(spatial))
+    return other[:n_selections] + spatial[:n_crops] + other[n_selections:] + spatial[n_crops:]
+
+
+def plan(chain, resolution=None):
+    """Reordered chain (operators in order of application); resolution in degrees of the
+    source grid for the pre-crop padding, None for no pre-crop."""
+    known = time_selections + field_selections + field_changes + remappings + (crop,)
+    pad = None if resolution is None else pad_cells * resolution
+    result, segment = [], []
+    for op in chain:
+        if op[0] in known:
+            segment.append(op)
+        else: # unknown operator, nothing moves past it
+            result += reorder(segment, pad) + [op]
+            segment = []
+    return result + reorder(segment, pad)
+
+
+def split(chain):
+    """(years, level, box, rest): leading selyear, sellevel and sellonlatbox for
+    virtual_dataset.py and the rest of the chain for cdo."""
+    years = level = box = None
+    for i, (name, args) in enumerate(chain):
+        if name == 'selyear' and years is None and '/' in args and ',' not in args:
+            years = tuple(int(y) for y in args.split('/'))
+        elif name == 'sellevel' and level is None and ',' not in args:
+            level = float(args)
+        elif name == crop and box is None:
+            box = tuple(float(x) for x in args.split(','))
+        else:
+            return years, level, box, chain[i:]
+    return years, level, box, []
+
+
+def command(chain, input, output):
+    """cdo command (argv) of a chain, e.g. cdo -O sellonlatbox,... -remapbil,grid.nc in out."""
+    if not chain:
+        return ['cdo', '-O', 'copy', input, output]
+    operators = [name + ('' if args is None else ',' + args) for name, args in chain[::-1]]
+    return ['cdo', '-O', operators[0]] + ['-' + op for op in operators[1:]] + [input, output]
+
+
+def run(chain, input, output):
+    """Run a chain with cdo unless the output exists (as force = False)."""
+    if os.path.exists(output):
+        return False
+    # written to a temporary name first, so an interrupted run does not look done
+    subprocess.check_call(command(chain, input, output + '.tmp'))
+    os.replace(output + '.tmp', output)
+    return True
+
+
+def same_output(a, b, rtol=1e-5, variables=None):
+    """True if two netCDF files have the same variables (or the given ones), shapes and
+    (masked) values."""
+    with Dataset(a) as x, Dataset(b) as y:
+        if variables is None and set(x.variables) != set(y.variables):
+            return False
+        for name in variables or x.variables:
+            u, v = x.variables[name][:], y.variables[name][:]
+            if u.shape != v.shape or np.any(np.ma.getmaskarray(u) != np.ma.getmaskarray(v)):
+                return False
+            if u.dtype.kind in 'fiu' and not np.ma.allclose(u, v, rtol=rtol):
+                return False
+    return True
+
+
+def equivalent(chain, planned, sample, workdir):
+    """Run the original and the planned chain on a sample file (e.g. the first time steps
+    of a model file) and compare; the time selections are left out of both chains."""
+    original = [op for op in chain if op[0] not in time_selections]
+    reordered = [op for op in planned if op[0] not in time_selections]
+    if original == reordered:
+        return True
+    outputs = [os.path.join(workdir, os.path.basename(sample)[:-3] + suffix)
+               for suffix in ('_original.nc', '_planned.nc')]
+    try:
+        for c, output in zip((original, reordered), outputs):
+            subprocess.check_call(command(c, sample, output))
+        return same_output(*outputs)
+    finally:
+        for output in outputs:
+            if os.path.exists(output):
+                os.remove(output)
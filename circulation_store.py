@@ -0,0 +1,163 @@
+# Purpose: Compact binary store for circulation type matrices, so that R, MATLAB and Python
+#          do not have to re-parse the whitespace separated cost733class text files
+#          (1) convert data/cost_*.dat or data/WTC_MCH_19570901-20180831.dat into a store
+#          (2) open the store memory-mapped, i.e. near-instant and without reading the data
+#          (3) select a season x period slice of all members as a zero-copy view
+#
+#          a store is a directory '<name>.ctstore' with the files
+#          types.u8  -> uint8 circulation types, one column per member (column-major), i.e.
+#                       member j occupies bytes j*n_days ... (j+1)*n_days-1; 255 = NaN
+#          dates.i16 -> int16 YYYY MM DD of every row (row-major, 3 values per row)
+#          rows.i32  -> int32 row number of every row in the original text file
+#          meta.json -> member names, number of days, season offsets, ...
+#          the rows are grouped by season (spring, summer, fall, winter as in the R scripts)
+#          and sorted by date within each season, so every season x period selection is one
+#          contiguous block of rows. In R: readBin('types.u8', 'raw', n) and matrix(..., ncol)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import json
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+from calendar_conversion import seasons, season_of_month
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+
+format_version = 1
+
+
+def member_names(filename, n_members):
+    """Member names from the '.members' sidecar of assemble_ensemble.py, if it exists."""
+    if not os.path.exists(filename + '.members'):
+        return None
+    with open(filename + '.members', 'r') as f:
+        names = [line.strip() for line in f if line.strip()]
+    return names if len(names) == n_members else None
+
+
+def convert(filename, store=None):
+    """Convert a cost733class text matrix or the WTC file into a binary store."""
+    if store is None:
+        store = os.path.splitext(filename)[0] + '.ctstore'
+    dates, types, names = cost_parser.read(filename)
+    names = member_names(filename, types.shape[1]) or names
+    write_store(store, dates, types, names, source=os.path.basename(filename))
+    return store
+
+
+def write_store(store, dates, types, names, source=''):
+    """Write dates (n, 3) and types (n, n_members) into a store directory.
+
+    types is either uint8 with the missing sentinel (as from cost_parser.read()) or a
+    float array with NaN for missing days.
+    """
+    if np.asarray(types).dtype == np.uint8:
+        valid = np.asarray(types) != missing
+    else:
+        types = np.asarray(types, dtype=float)
+        valid = ~np.isnan(types)
+        if np.any((types[valid] < 0) | (types[valid] >= missing) | (types[valid] % 1 != 0)):
+            raise ValueError('circulation types must be integers between 0 and ' +
+                             str(missing - 1))
+
+    # order rows by season and date, i.e. every season x period is a contiguous block
+    season = season_of_month(dates[:, 1])
+    key = dates[:, 0].astype(np.int64) * 10000 + dates[:, 1] * 100 + dates[:, 2]
+    rows = np.lexsort((key, season)).astype(np.int32)
+    offsets = np.searchsorted(season[rows], np.arange(len(seasons) + 1))
+
+    os.makedirs(store, exist_ok=True)
+    u8 = np.where(valid, types, missing).astype(np.uint8)[rows]
+    u8.T.tofile(os.path.join(store, 'types.u8')) # written member by member, i.e. column-major
+    np.ascontiguousarray(dates[rows], dtype=np.int16).tofile(os.path.join(store, 'dates.i16'))
+    rows.tofile(os.path.join(store, 'rows.i32'))
+
+    meta = {'format_version': format_version, 'source': source,
+            'n_days': int(len(rows)), 'n_members': int(types.shape[1]),
+            'members': list(names), 'missing': missing, 'seasons': list(seasons),
+            'season_offsets': [int(o) for o in offsets],
+            'types_file': 'types.u8', 'types_dtype': 'uint8', 'types_order': 'F',
+            'dates_file': 'dates.i16', 'dates_dtype': 'int16',
+            'rows_file': 'rows.i32', 'rows_dtype': 'int32'}
+    with open(os.path.join(store, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class CirculationStore:
+    """Memory-mapped circulation type store created with convert()."""
+
+    def __init__(self, store):
+        with open(os.path.join(store, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != format_version:
+            raise ValueError('unsupported store format version: ' +
+                             str(self.meta['format_version']))
+        n_days, n_members = self.meta['n_days'], self.meta['n_members']
+        self.path = store
+        self.members = self.meta['members']
+        self.missing = self.meta['missing']
+        self.types = np.memmap(os.path.join(store, 'types.u8'), dtype=np.uint8, mode='r',
+                               shape=(n_days, n_members), order='F')
+        self.dates = np.memmap(os.path.join(store, 'dates.i16'), dtype=np.int16, mode='r',
+                               shape=(n_days, 3))
+        self.rows = np.memmap(os.path.join(store, 'rows.i32'), dtype=np.int32, mode='r',
+                              shape=(n_days,))
+
+    def season_rows(self, season, years=None):
+        """Slice of the rows of one season, optionally restricted to years (first, last)."""
+        s = seasons.index(season) if isinstance(season, str) else season
+        start, stop = self.meta['season_offsets'][s:s + 2]
+        if years is not None:
+            year = self.dates[start:stop, 0]
+            stop = start + np.searchsorted(year, years[1], side='right')
+            start = start + np.searchsorted(year, years[0], side='left')
+        return slice(int(start), int(stop))
+
+    def select(self, season, years=None, members=None):
+        """Zero-copy view (types, dates) of one season x period for all or some members.
+
+        members -> None for all members or a slice of member columns (a list of names or
+                   indices works as well but then returns a copy)
+        """
+        rows = self.season_rows(season, years)
+        if members is None:
+            return self.types[rows], self.dates[rows]
+        if not isinstance(members, slice):
+            members = [self.members.index(m) if isinstance(m, str) else m for m in members]
+        return self.types[rows, members], self.dates[rows]
+
+    def column(self, member):
+        """Zero-copy view of all days of one member (in store row order)."""
+        j = self.members.index(member) if isinstance(member, str) else member
+        return self.types[:, j]
+
+    def chronological(self):
+        """Copy of (types, dates) in the row order of the original text file."""
+        order = np.argsort(self.rows)
+        return np.asarray(self.types)[order], np.asarray(self.dates)[order]
+
+    def as_float(self, types):
+        """Float copy of a types array with NaN for missing days."""
+        return cost_parser.as_float(types)
+
+
+def open_store(store):
+    """Open a store directory memory-mapped."""
+    return CirculationStore(store)
+
+
+if __name__ == '__main__':
+    # convert all given text files, e.g. python circulation_store.py data/cost_*.dat
+    for filename in sys.argv[1:]:
+        starttime = datetime.now() # start stopwatch
+        print(filename + ' -> ' + convert(filename))
+        print(datetime.now() - starttime)
@@ -0,0 +1,160 @@
+# Purpose: Grid point significance and model agreement of the future - past differences of
+#          the circulation type composites (Figs. S9-S20), which so far show only the ensemble
+#          mean difference
+#          (1) mean and variance of every member, season, type and grid point from the sums,
+#              sums of squares and counts of composites.py (float64), no daily fields needed
+#          (2) Welch t-statistic and degrees of freedom (Welch-Satterthwaite) of 2070-2099 vs
+#              1988-2017 for every member from the daily values, and across the members from
+#              their composites; two-sided p-values from the t distribution
+#          (3) model agreement: fraction of the members with a difference of the same sign as
+#              the ensemble mean difference, and fraction of the members with a significant
+#              difference of that sign
+#          (4) all arrays are (member,) season, type, lat, lon and computed at once
+#          note: the daily values are autocorrelated, so the t-statistics of a single member
+#          overstate the significance; the fractions of (2) and (3) are meant for stippling
+#          usage: python composite_significance.py output.npz past.npz [past.npz ...] --
+#                        future.npz [future.npz ...]   (npz files of composites.py, one per
+#                                                       member in the same order)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import scipy.special
+
+alpha = 0.05 # significance level of the two-sided tests
+
+
+def moments(sums, squares, counts):
+    """Mean and unbiased variance from sums, sums of squares and counts; NaN without values
+    (mean) or with less than two values (variance)."""
+    counts = np.asarray(counts, dtype='f8')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(counts > 0, sums / counts, np.nan)
+        variance = np.where(counts > 1, (squares - counts * mean ** 2) / (counts - 1), np.nan)
+    return mean, np.maximum(variance, 0.) # rounding can give tiny negative variances
+
+
+def welch(mean_a, variance_a, n_a, mean_b, variance_b, n_b):
+    """Welch t-statistic of b - a and the Welch-Satterthwaite degrees of freedom."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error_a, error_b = variance_a / n_a, variance_b / n_b
+        t = (mean_b - mean_a) / np.sqrt(error_a + error_b)
+        df = (error_a + error_b) ** 2 / (error_a ** 2 / (n_a - 1) + error_b ** 2 / (n_b - 1))
+    return t, df
+
+
+def p_value(t, df):
+    """Two-sided p-value of t-statistics (NaN where t or df is not defined)."""
+    return 2 * scipy.special.stdtr(df, -np.abs(t))
+
+
+def load_members(files, variable):
+    """Sums, sums of squares and counts (member, season, type, lat, lon) of a variable.
+
+    All files must have the same number of types (n_types of composites.py).
+    """
+    arrays = [[], [], []]
+    n_types = None
+    for filename in files:
+        with np.load(filename) as f:
+            if n_types is None:
+                n_types = int(f['n_types'])
+            elif int(f['n_types']) != n_types:
+                raise ValueError(filename + ': ' + str(int(f['n_types'])) +
+                                 ' types instead of ' + str(n_types))
+            for a, suffix in zip(arrays, ('_sum', '_squares', '_count')):
+                a.append(f[variable + suffix])
+    return [np.stack(a) for a in arrays]
+
+
+def significance(past, future, alpha=alpha):
+    """Significance and agreement of future - past from (sums, squares, counts) of both
+    periods, each (member, season, type, ...).
+
+    Returns a dict with arrays (member, season, type, ...)
+        difference -> future - past composite of every member
+        t, df, p   -> Welch test of the daily values of every member
+    and arrays (season, type, ...) across the members
+        mean_difference      -> ensemble mean of the differences
+        ensemble_t, ensemble_df, ensemble_p -> Welch test of the member composites
+        agreement            -> fraction of the members with the sign of mean_difference
+        significant_agreement -> fraction with a significant difference of that sign
+        members              -> number of members with a difference
+    """
+    (mean_p, variance_p), n_p = moments(*past), past[2]
+    (mean_f, variance_f), n_f = moments(*future), future[2]
+    result = {'difference': mean_f - mean_p}
+    result['t'], result['df'] = welch(mean_p, variance_p, n_p, mean_f, variance_f, n_f)
+    result['p'] = p_value(result['t'], result['df'])
+
+    # across the members, their composites as the samples (members with both periods)
+    difference = result['difference']
+    valid = np.isfinite(difference)
+    members = valid.sum(axis=0)
+    ensemble = []
+    for mean in (mean_p, mean_f):
+        values = np.where(valid, mean, 0.)
+        ensemble.append(moments(values.sum(axis=0), (values ** 2).sum(axis=0), members))
+    result['mean_difference'] = ensemble[1][0] - ensemble[0][0]
+    result['ensemble_t'], result['ensemble_df'] = welch(*ensemble[0], members,
+                                                        *ensemble[1], members)
+    result['ensemble_p'] = p_value(result['ensemble_t'], result['ensemble_df'])
+
+    # sign agreement with the ensemble mean difference
+    sign = np.sign(result['mean_difference'])
+    same = valid & (np.sign(difference) == sign)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['agreement'] = np.where(members > 0, same.sum(axis=0) / members, np.nan)
+        result['significant_agreement'] = np.where(
+            members > 0, (same & (result['p'] < alpha)).sum(axis=0) / members, np.nan)
+    result['members'] = members
+    return result
+
+
+def variables_of(filename):
+    """Variables with accumulators in a npz file of composites.py."""
+    with np.load(filename) as f:
+        return [name[:-4] for name in f.files if name.endswith('_sum')]
+
+
+def save(filename, results, grid):
+    """Write the results of all variables (<variable>_<name>) to a npz file."""
+    arrays = {'lon': grid[0], 'lat': grid[1]}
+    for variable, result in results.items():
+        arrays.update({variable + '_' + name: a for name, a in result.items()})
+    # written to a temporary name first, so an interrupted run does not leave an output
+    with open(filename + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(filename + '.tmp', filename)
+
+
+if __name__ == '__main__':
+    if '--' not in sys.argv[2:] or len(sys.argv) < 5:
+        sys.exit('usage: python composite_significance.py output.npz past.npz [past.npz ...] '
+                 '-- future.npz [future.npz ...]')
+    starttime = datetime.now() # start stopwatch
+    separator = sys.argv.index('--', 2)
+    past_files, future_files = sys.argv[2:separator], sys.argv[separator + 1:]
+    if len(past_files) != len(future_files):
+        sys.exit(str(len(past_files)) + ' past and ' + str(len(future_files)) +
+                 ' future files, one of each per member')
+    with np.load(past_files[0]) as f:
+        grid = f['lon'], f['lat']
+    results = {}
+    for variable in variables_of(past_files[0]):
+        results[variable] = significance(load_members(past_files, variable),
+                                         load_members(future_files, variable))
+        print(variable + ': ' + str(results[variable]['agreement'].shape) + ', ' +
+              str(len(past_files)) + ' members')
+    save(sys.argv[1], results, grid)
+    print(datetime.now() - starttime)
@@ -0,0 +1,217 @@
+# Purpose: Circulation type composites of the daily maps (zg, tas, psl, pr) in one pass over
+#          the files, replacing the loops over season x type x period x member in
+#          extract_patterns_cmip5_with_differences.m and extract_patterns_cesm_with_differences.m
+#          which read every file again (getnc + permute) for each season and type
+#          (1) the circulation types of a member are looked up for every time step of the maps
+#              files by (year, day of year) in the calendar of the model, i.e. the leap days
+#              inserted into the cost733class output (leap_days.py) are removed again for
+#              365_day models, no hardcoded row ranges as 10228:21185
+#          (2) every field is read once in blocks of time steps (virtual_dataset.py) and every
+#              day is added to the sum and count of its (season, type) group, with one matrix
+#              product per block (groups x days times days x grid points)
+#          (3) all 4 x 10 composites (season, type, lat, lon) of every variable of a member
+#              come out of that single pass; missing values are left out as nanmean
+#          (4) the sums of squares are accumulated as well, for the significance of the
+#              future - past differences (composite_significance.py)
+#          (5) the number of types is the configured number of classes (n_types), not the
+#              largest type a member happens to have, so all members give arrays of the same
+#              shape; it is stored in the npz file
+#          usage: python composites.py cost_matrix.dat member output.npz maps.nc [maps.nc ...]
+#                 e.g. python composites.py data/cost_CMIP5_historical_rcp85_1960-2099_Z500.dat
+#                      e01 ACCESS1-0_past.npz *_day_ACCESS1-0_r1i1p1_1988-2017.nc
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+from netCDF4 import Dataset
+import cost_parser # chunked parser for the text files
+import virtual_dataset # blocks of time steps of the maps files
+from calendar_conversion import (seasons, season_of_month, normalise_calendar, year_blocks,
+                                 days_per_year, padding_mask)
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from seasonal_anomalies import valid_values
+
+chunk = 3650 # time steps read at once
+n_types = 10 # classes of cost733class (-ncl 10 in merging_cmip5.py, preprocessing_cesm.py)
+
+
+def type_table(dates, types, calendar='gregorian'):
+    """Circulation types of one member by (year, day of year) in the model calendar.
+
+    dates -> (n_days, 3) Gregorian YYYY MM DD of the rows of the cost733class matrix
+    types -> uint8 types of the member (255 = NaN)
+    For 365_day and 360_day models the padding days of every year are removed first: the
+    NaN days of that year if there are as many as padding days (leap_days.py), otherwise
+    the fixed days of calendar_conversion.padding_mask. Returns the first year and a uint8
+    table (year, day of year - 1), 255 where there is no type.
+    """
+    types = np.asarray(types)
+    calendar = normalise_calendar(calendar)
+    years, start, length = year_blocks(dates)
+    year = np.repeat(np.arange(len(start)), length) # year number of every row
+    keep = np.ones(len(dates), dtype=bool)
+    if calendar != 'gregorian':
+        n_pad = length - days_per_year[calendar]
+        nan_days = types == missing
+        own = (np.bincount(year, weights=nan_days, minlength=len(start)) == n_pad)[year]
+        keep = ~np.where(own, nan_days, padding_mask(dates, calendar)[:, 0])
+
+    # day of the year in the model: position among the kept rows of that year
+    kept = np.cumsum(keep)
+    day = kept - 1 - (kept - keep)[start][year]
+    table = np.full((len(start), 366), missing, dtype=np.uint8)
+    table[year[keep], day[keep]] = types[keep]
+    return int(years[0]), table
+
+
+def day_types(model_dates, first_year, table):
+    """Circulation types of the time steps (cftime dates) of a model file, 255 if unknown."""
+    year = np.array([d.year for d in model_dates]) - first_year
+    day = np.array([d.dayofyr for d in model_dates]) - 1
+    inside = (year >= 0) & (year < table.shape[0])
+    types = np.full(len(year), missing, dtype=np.uint8)
+    types[inside] = table[year[inside], day[inside]]
+    return types
+
+
+class Composites:
+    """Sums, sums of squares and counts (season, type, ...) of the daily fields of one
+    variable."""
+
+    def __init__(self, n_types, shape):
+        self.n_types = n_types
+        self.shape = tuple(shape) # grid of one day, e.g. (lat, lon)
+        n_groups = len(seasons) * n_types
+        self.sums = np.zeros((n_groups, int(np.prod(shape)))) # float64
+        self.squares = np.zeros((n_groups, int(np.prod(shape))))
+        self.counts = np.zeros((n_groups, int(np.prod(shape))), dtype='i8')
+
+    def groups(self, months, types):
+        """Group number season * n_types + type - 1 of every day, -1 for NaN types."""
+        types = np.asarray(types).astype(np.int64)
+        valid = (types >= 1) & (types <= self.n_types)
+        return np.where(valid, season_of_month(months) * self.n_types + types - 1, -1)
+
+    def add(self, group, block, fill=None):
+        """Add a block (time, ...) with the group number of every time step."""
+        data = block.reshape(len(block), -1)
+        valid = valid_values(data, fill)
+        days = np.flatnonzero(group >= 0)
+        # one-hot (groups x days): the scatter-add of all days is one matrix product
+        onehot = np.zeros((self.sums.shape[0], len(days)))
+        onehot[group[days], np.arange(len(days))] = 1.
+        values = np.where(valid[days], data[days], 0.).astype('f8')
+        self.sums += onehot @ values
+        self.squares += onehot @ values ** 2
+        self.counts += np.rint(onehot @ valid[days].astype('f8')).astype('i8')
+
+    def sum(self):
+        return self.sums.reshape((len(seasons), self.n_types) + self.shape)
+
+    def square(self):
+        return self.squares.reshape((len(seasons), self.n_types) + self.shape)
+
+    def count(self):
+        return self.counts.reshape((len(seasons), self.n_types) + self.shape)
+
+    def mean(self):
+        """Composites (season, type, ...), NaN where a group has no valid day."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count() > 0, self.sum() / self.count(), np.nan)
+
+
+def map_variables(filename):
+    """Variables of a maps file with time, latitude and longitude dimensions."""
+    names = []
+    with Dataset(filename) as nc:
+        for name, var in nc.variables.items():
+            try:
+                for kind in ('time', 'lat', 'lon'):
+                    virtual_dataset.find_coordinate(nc, var, kind)
+            except ValueError: # coordinates, bounds, ...
+                continue
+            names.append(name)
+    return names
+
+
+def member_composites(files, dates, types, n_types, variables=None, chunk=chunk):
+    """Composites of all variables in the maps files of one member and period.
+
+    files     -> maps files (e.g. zg, tas, psl and pr of preprocessing_cmip5_maps_data.py, or
+                 the merged file of preprocessing_cesm_maps_data.py)
+    dates     -> (n_days, 3) dates of the cost733class matrix, types -> types of the member
+    n_types   -> number of classes of the classification (types above are left out)
+    variables -> names to use, default all map variables of the files
+    Returns a dict variable -> Composites and the (lon, lat) of the grid.
+    """
+    types = np.asarray(types)
+    tables = {} # type table per calendar
+    result, grid = {}, None
+    for filename in files:
+        for variable in map_variables(filename):
+            if variables is not None and variable not in variables:
+                continue
+            dataset = virtual_dataset.VirtualDataset([filename], variable)
+            calendar = normalise_calendar(dataset.calendar)
+            if calendar not in tables:
+                tables[calendar] = type_table(dates, types, calendar)
+            months = np.array([d.month for d in dataset.dates])
+            level = None if dataset.level_name is None else float(dataset.levels[0])
+            if variable not in result:
+                result[variable] = Composites(n_types, (len(dataset.lat), len(dataset.lon)))
+                grid = dataset.lon, dataset.lat
+            composites = result[variable]
+            group = composites.groups(months, day_types(dataset.dates, *tables[calendar]))
+            position = 0
+            for values, block in dataset.blocks(level=level, chunk=chunk):
+                composites.add(group[position:position + len(values)], block, dataset.fill)
+                position += len(values)
+    return result, grid
+
+
+def member_column(names, member):
+    """Column of a member given by name (e.g. e01) or number (1 = first member)."""
+    if member in names:
+        return names.index(member)
+    return int(member) - 1
+
+
+def save(filename, composites, grid, n_types=n_types):
+    """Write the composites, sums, sums of squares and counts of all variables to a npz
+    file."""
+    arrays = {'seasons': np.array(seasons), 'lon': np.asarray(grid[0]),
+              'lat': np.asarray(grid[1]), 'n_types': n_types}
+    for variable, c in composites.items():
+        arrays[variable] = c.mean()
+        arrays[variable + '_sum'] = c.sum()
+        arrays[variable + '_squares'] = c.square()
+        arrays[variable + '_count'] = c.count()
+    # written to a temporary name first, so an interrupted run does not leave an output
+    with open(filename + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(filename + '.tmp', filename)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        sys.exit('usage: python composites.py cost_matrix.dat member output.npz maps.nc '
+                 '[maps.nc ...]')
+    starttime = datetime.now() # start stopwatch
+    dates, types, names = cost_parser.read(sys.argv[1])
+    column = member_column(names, sys.argv[2])
+    composites, grid = member_composites(sys.argv[4:], dates, types[:, column], n_types)
+    save(sys.argv[3], composites, grid, n_types)
+    for variable, c in composites.items():
+        print(variable + ': ' + str(c.count().shape[:2]) + ' composites, ' +
+              str(int(c.counts[:, 0].sum())) + ' days')
+    print(datetime.now() - starttime)
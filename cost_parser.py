@@ -0,0 +1,199 @@
+# Purpose: Chunked parser for the text files in data/, i.e. cost733class output matrices,
+#          the MeteoSwiss WTC file and the date vectors
+#          handles all the formats we have:
+#          - tab and space separated columns (paste output) and 'nan' leap days
+#          - date.dat with integer YYYY MM DD
+#          - date_no_leap_days.dat with YYYY MM DD as scientific notation floats
+#          - WTC_MCH_19570901-20180831.dat with a header line and YYYYMMDD dates
+#          the file is read in blocks of complete lines (bounded memory) and every block is
+#          tokenized and converted with whole-array operations on the raw bytes into typed
+#          NumPy arrays: int16 dates (YYYY, MM, DD) and uint8 circulation types with 255 for NaN
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+
+missing = 255          # uint8 sentinel for NaN, i.e. leap days inserted by leap_days.py
+chunk_bytes = 1 << 22  # number of bytes parsed at once (always cut at a line break)
+max_digits = 9         # longer tokens (e.g. 1.9600000000000000e+03) are parsed as floats
+
+
+def file_layout(filename):
+    """Detect the layout of a file from its first line.
+
+    Returns (kind, n_columns, names, header_lines) with kind 'wtc' (MeteoSwiss WTC file),
+    'matrix' (YYYY MM DD + members) or 'dates' (YYYY MM DD only).
+    """
+    with open(filename, 'rb') as f:
+        first = f.readline().split()
+    if not first:
+        raise ValueError('empty first line in ' + filename)
+
+    if first[0] == b'abbr': # abbr time wkwtp1d0 wkwtg1d0 ...
+        return 'wtc', len(first), [n.decode() for n in first[2:]], 1
+    if len(first) == 3:
+        return 'dates', 3, [], 0
+    n_members = len(first) - 3
+    return 'matrix', len(first), ['e%02d' % (i + 1) for i in range(n_members)], 0
+
+
+def tokenize(buf):
+    """Start and end byte of every whitespace separated token in a uint8 buffer."""
+    space = buf <= 32 # blank, tab, line breaks
+    edge = np.diff(np.r_[True, space, True].view(np.int8))
+    return np.flatnonzero(edge == -1), np.flatnonzero(edge == 1)
+
+
+def token_integers(buf, starts, ends):
+    """Integer value of every token and a flag for tokens which are not plain integers.
+
+    The digits are accumulated position by position over all tokens at once, i.e. only
+    as many passes as the longest token has characters (1-2 for circulation types).
+    """
+    length = ends - starts
+    value = np.zeros(len(starts), dtype=np.int64)
+    other = length > max_digits # e.g. scientific notation, parsed as float later
+    for k in range(min(int(length.max(initial=0)), max_digits)):
+        i = np.flatnonzero((length > k) & ~other)
+        digit = buf[starts[i] + k].astype(np.int64) - 48
+        other[i[(digit < 0) | (digit > 9)]] = True
+        value[i] = value[i] * 10 + digit
+    return value, other
+
+
+def token_floats(buf, starts, ends, index):
+    """Float value of some tokens (nan, NA, 1.96e+03, ...), NA is returned as NaN."""
+    data = buf.tobytes()
+    values = np.empty(len(index))
+    for n, i in enumerate(index):
+        token = data[starts[i]:ends[i]]
+        if token == b'NA': # missing value written by R
+            values[n] = np.nan
+            continue
+        try:
+            values[n] = float(token)
+        except ValueError:
+            raise ValueError('invalid token ' + repr(token.decode(errors='replace')) +
+                             ' at byte ' + str(starts[i]) + ' of the block')
+    return values
+
+
+def float_columns(buf, n_rows, n_columns):
+    """All tokens of a purely numeric block parsed as floats by NumPy in one go."""
+    values = np.fromstring(buf.tobytes(), sep=' ') # any whitespace separates, nan is parsed
+    if len(values) != n_rows * n_columns:
+        raise ValueError('block contains tokens which are not numbers')
+    return values.reshape(n_rows, n_columns)
+
+
+def parse_chunk(buf, kind, n_columns, first_line=1):
+    """Convert a uint8 buffer of complete lines into (dates (n, 3) int16, types (n, m) uint8)."""
+    starts, ends = tokenize(buf)
+
+    # number of tokens in every line -> all non-empty lines must have n_columns tokens
+    line_end = np.flatnonzero(buf == 10)
+    if len(line_end) == 0 or line_end[-1] != len(buf) - 1:
+        line_end = np.r_[line_end, len(buf)]
+    per_line = np.diff(np.r_[0, np.searchsorted(starts, line_end)])
+    wrong = np.flatnonzero((per_line != 0) & (per_line != n_columns))
+    if len(wrong):
+        raise ValueError('row ' + str(first_line + wrong[0]) + ' has ' +
+                         str(per_line[wrong[0]]) + ' columns, expected ' + str(n_columns))
+    n_rows = len(starts) // n_columns
+
+    value, other = token_integers(buf, starts, ends)
+    value = value.reshape(n_rows, n_columns)
+    other = other.reshape(n_rows, n_columns)
+
+    if kind == 'wtc': # abbr YYYYMMDD types...
+        time = value[:, 1]
+        dates = np.column_stack([time // 10000, time // 100 % 100, time % 100])
+        first_type = 2
+        if np.any(other[:, 1]):
+            raise ValueError('invalid YYYYMMDD date near row ' + str(first_line))
+    else:
+        dates = value[:, :3].astype(np.float64)
+        first_type = 3
+        if np.any(other[:, :3]): # dates as floats, e.g. date_no_leap_days.dat
+            dates = float_columns(buf, n_rows, n_columns)[:, :3]
+        if np.any(np.isnan(dates)) or np.any(dates % 1 != 0):
+            raise ValueError('invalid YYYY MM DD date near row ' + str(first_line))
+
+    types = value[:, first_type:]
+    invalid = other[:, first_type:].copy()
+    if np.any(invalid): # nan leap days; anything else than nan/NA is an error
+        rows, cols = np.nonzero(invalid)
+        token = rows * n_columns + cols + first_type
+        numbers = token_floats(buf, starts, ends, token)
+        number = ~np.isnan(numbers) # e.g. 3.0 written by R or MATLAB
+        if np.any(numbers[number] % 1 != 0):
+            raise ValueError('circulation types must be integers, near row ' + str(first_line))
+        types[rows[number], cols[number]] = numbers[number].astype(np.int64)
+        invalid[rows[number], cols[number]] = False
+    if np.any((types[~invalid] < 0) | (types[~invalid] >= missing)):
+        raise ValueError('circulation types must be between 0 and ' + str(missing - 1) +
+                         ', near row ' + str(first_line))
+    types = np.where(invalid, missing, types).astype(np.uint8)
+    return dates.astype(np.int16), types
+
+
+def iter_chunks(filename, size=chunk_bytes):
+    """Generator yielding (dates, types) of blocks of about 'size' bytes of a file."""
+    kind, n_columns, _, header = file_layout(filename)
+    with open(filename, 'rb') as f:
+        for _ in range(header):
+            f.readline()
+        line_number = header + 1
+        rest = b''
+        while True:
+            block = f.read(size)
+            data = rest + block
+            if not block: # end of file, last line may miss its line break
+                if data.strip():
+                    yield parse_chunk(np.frombuffer(data, np.uint8), kind, n_columns,
+                                      line_number)
+                break
+            cut = data.rfind(b'\n') + 1 # only parse complete lines
+            rest = data[cut:]
+            if cut == 0:
+                continue
+            yield parse_chunk(np.frombuffer(data[:cut], np.uint8), kind, n_columns,
+                              line_number)
+            line_number += data.count(b'\n', 0, cut)
+
+
+def read(filename, size=chunk_bytes):
+    """Parse a whole file, returns dates (n, 3) int16, types (n, m) uint8 and names."""
+    kind, n_columns, names, _ = file_layout(filename)
+    chunks = list(iter_chunks(filename, size))
+    n_members = 0 if kind == 'dates' else len(names)
+    if not chunks:
+        return np.zeros((0, 3), np.int16), np.zeros((0, n_members), np.uint8), names
+    dates = np.concatenate([c[0] for c in chunks])
+    types = np.concatenate([c[1] for c in chunks])
+    return dates, types, names
+
+
+def as_float(types):
+    """Float copy of a uint8 types array with NaN for missing days."""
+    out = np.asarray(types, dtype=float)
+    out[np.asarray(types) == missing] = np.nan
+    return out
+
+
+if __name__ == '__main__':
+    # parse all given files and print their size, e.g. python cost_parser.py data/*.dat
+    for filename in sys.argv[1:]:
+        starttime = datetime.now() # start stopwatch
+        dates, types, names = read(filename)
+        print(filename + ': ' + str(len(dates)) + ' days, ' + str(types.shape[1]) +
+              ' columns, ' + str(datetime.now() - starttime))
@@ -0,0 +1,216 @@
+# Purpose: Precomputed date index over data/date.dat and data/date_no_leap_days.dat, so
+#          period and season selections are a lookup instead of date string comparisons
+#          (replaces hardcoded row ranges such as 10228:21185 in the MATLAB scripts and the
+#          as.Date(cut(...)) + 32 / quarters() season vectors in the R scripts)
+#          (1) read the date vector once and store year, season and the first row of every
+#              year in a cache file next to it ('<date file>.index.npz')
+#          (2) a year range is a slice of rows computed from the first row of each year
+#          (3) a season within a year range is a boolean mask or an array of row numbers;
+#              the past/future x spring/summer/fall/winter rows are precomputed in the cache
+#              and any other combination is memoized after its first use
+#          (4) the analysis scripts (frequency.py, persistence.py, bootstrap.py) look up the
+#              index of the dates of their cost733class matrix with index_of(), i.e. the cached
+#              index when the matrix has the dates of date.dat or date_no_leap_days.dat
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+from calendar_conversion import seasons, season_of_month
+
+# date vectors of the two calendars of the cost733class matrices
+path_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+date_files = {'gregorian': os.path.join(path_data, 'date.dat'),
+              'noleap': os.path.join(path_data, 'date_no_leap_days.dat')}
+
+# past and future periods of the study (30 years each)
+periods = {'past': (1988, 2017), 'future': (2070, 2099)}
+cache_version = 1
+
+_loaded = {} # date indices already loaded in this session
+
+
+class DateIndex:
+    """Year, season and row lookups for one date vector (chronologically sorted)."""
+
+    def __init__(self, dates, season, year_start, first_year, precomputed=None):
+        self.dates = dates
+        self.season = season # season index per row, 0 = spring ... 3 = winter
+        self.year_start = year_start # first row of every year, plus the number of rows
+        self.first_year = first_year
+        self.last_year = first_year + len(year_start) - 2
+        self.season_masks = [season == s for s in range(len(seasons))]
+        self._rows = dict(precomputed or {})
+
+    def __len__(self):
+        return len(self.dates)
+
+    def period_rows(self, years=None):
+        """Slice of rows covering all days of the years (first, last), e.g. (1988, 2017)."""
+        if years is None:
+            return slice(0, len(self.dates))
+        if isinstance(years, str):
+            years = periods[years]
+        first = min(max(years[0], self.first_year), self.last_year + 1) - self.first_year
+        last = min(max(years[1], self.first_year - 1), self.last_year) - self.first_year
+        return slice(int(self.year_start[first]), int(self.year_start[max(last + 1, first)]))
+
+    def mask(self, years=None, season=None):
+        """Boolean mask over all rows for a year range and season (None = all seasons)."""
+        mask = np.zeros(len(self.dates), dtype=bool)
+        rows = self.period_rows(years)
+        if season is None:
+            mask[rows] = True
+        else:
+            mask[rows] = self.season_masks[season_number(season)][rows]
+        return mask
+
+    def rows(self, years=None, season=None):
+        """Row numbers (int array) of a year range and season, memoized per combination."""
+        if isinstance(years, str):
+            years = periods[years]
+        key = (tuple(years) if years is not None else None,
+               None if season is None else season_number(season))
+        if key not in self._rows:
+            rows = self.period_rows(years)
+            if key[1] is None:
+                self._rows[key] = np.arange(rows.start, rows.stop)
+            else:
+                self._rows[key] = rows.start + np.flatnonzero(
+                    self.season_masks[key[1]][rows])
+        return self._rows[key]
+
+    def select(self, data, years=None, season=None):
+        """Rows of data (aligned with the date vector) for a year range and season.
+
+        A whole year range without season is returned as a view, otherwise a copy.
+        """
+        if season is None:
+            return data[self.period_rows(years)]
+        return data[self.rows(years, season)]
+
+
+def day_numbers(dates, calendar='gregorian'):
+    """Running day number of every date, i.e. consecutive days differ by exactly one.
+
+    calendar = 'noleap' counts 365 days per year, so 28. February -> 1. March is
+    consecutive in every year (as in date_no_leap_days.dat).
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    year, month, day = dates[:, 0], dates[:, 1], dates[:, 2]
+    if calendar == 'noleap':
+        first_of_month = np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+        return year * 365 + first_of_month[month - 1] + day - 1
+    days = (np.asarray(year - 1970, dtype='datetime64[Y]') +
+            np.asarray(month - 1, dtype='timedelta64[M]')).astype('datetime64[D]')
+    return (days - np.datetime64('1970-01-01', 'D')).astype(np.int64) + day - 1
+
+
+def season_number(season):
+    """Season index (0 = spring, ..., 3 = winter) from a name or an index."""
+    return seasons.index(season) if isinstance(season, str) else int(season)
+
+
+def build_index(dates):
+    """Create the index of a chronologically sorted date vector (n, 3)."""
+    dates = np.asarray(dates, dtype=np.int16)
+    year = dates[:, 0].astype(np.int64)
+    if np.any(np.diff(year) < 0):
+        raise ValueError('date vector is not sorted chronologically')
+    first_year = int(year[0])
+    # first row of every year from first_year to last year + 1 (years without days allowed)
+    year_start = np.searchsorted(year, np.arange(first_year, year[-1] + 2)).astype(np.int64)
+    season = season_of_month(dates[:, 1]).astype(np.int8)
+
+    index = DateIndex(dates, season, year_start, first_year)
+    for years in periods.values(): # precompute the past/future x season combinations
+        for s in range(len(seasons)):
+            index.rows(years, s)
+    return index
+
+
+def index_of(dates):
+    """Date index of the dates of a cost733class matrix: the cached index of date.dat or
+    date_no_leap_days.dat if the dates are the same, otherwise built for these dates."""
+    dates = np.asarray(dates)
+    for calendar in date_files:
+        try:
+            index = load_index(calendar)
+        except OSError: # date vector not available
+            continue
+        if index.dates.shape == dates.shape and np.array_equal(index.dates, dates):
+            return index
+    return build_index(dates)
+
+
+def period_slices(dates, years):
+    """Row slices of year ranges (first, last) in a sorted date vector, e.g. the dates of a
+    cost733class matrix, as DateIndex.period_rows()."""
+    index = index_of(dates)
+    return [index.period_rows(y) for y in years]
+
+
+def cache_file(filename):
+    return filename + '.index.npz'
+
+
+def save_index(index, filename):
+    """Store the index next to its date vector together with the size/mtime of the source."""
+    stat = os.stat(filename)
+    keys = sorted(k for k in index._rows if k[0] is not None and k[1] is not None)
+    arrays = {'rows_%d_%d_%d' % (k[0][0], k[0][1], k[1]): index._rows[k] for k in keys}
+    np.savez(cache_file(filename), version=cache_version, dates=index.dates,
+             season=index.season, year_start=index.year_start, first_year=index.first_year,
+             source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64), **arrays)
+
+
+def load_cached(filename):
+    """Index from the cache file if it exists and belongs to the current date vector."""
+    try:
+        cache = np.load(cache_file(filename))
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    with cache:
+        if (int(cache['version']) != cache_version or
+                list(cache['source']) != [stat.st_size, stat.st_mtime_ns]):
+            return None
+        precomputed = {}
+        for name in cache.files:
+            if name.startswith('rows_'):
+                first, last, s = (int(v) for v in name[5:].split('_'))
+                precomputed[((first, last), s)] = cache[name]
+        return DateIndex(cache['dates'], cache['season'], cache['year_start'],
+                         int(cache['first_year']), precomputed)
+
+
+def load_index(calendar='gregorian', filename=None, cache=True):
+    """Date index of a calendar ('gregorian' -> date.dat, 'noleap' -> date_no_leap_days.dat).
+
+    The index is built once, written to '<date file>.index.npz' and afterwards read from
+    there (or from memory if it was already loaded in this session).
+    """
+    if filename is None:
+        filename = date_files[calendar]
+    filename = os.path.abspath(filename)
+    if filename in _loaded:
+        return _loaded[filename]
+
+    index = load_cached(filename) if cache else None
+    if index is None:
+        index = build_index(cost_parser.read(filename)[0])
+        if cache:
+            try:
+                save_index(index, filename)
+            except OSError: # e.g. read-only data directory, keep the index in memory only
+                pass
+    _loaded[filename] = index
+    return index
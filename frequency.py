@@ -0,0 +1,146 @@
+# Purpose: Vectorized seasonal frequency of circulation types for all ensemble members,
+#          replacing the loops over period, members, seasons and table() rows in
+#          Fig2_frequency_circulation_type_and_future_change.R
+#          (1) give every (row, member) of the member matrix a group number
+#              (period, member, season, type) and count all groups with one bincount
+#          (2) mean seasonal number of days per year (as table() / nyears in the R script),
+#              relative frequency in % of the valid days (leap day NaN left out) and the
+#              change future - past, also in % of the past frequency (Fig. 4)
+#          (3) write a long table (member, season, type, past, future, change) that can be
+#              read in R for the summary figures
+#          usage: python frequency.py cost_..._Z500.dat output.txt
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+from calendar_conversion import seasons, season_of_month
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import index_of, period_slices, periods
+
+
+def period_numbers(dates, years):
+    """Period number of every row (index into years), -1 for rows outside all periods."""
+    number = np.full(len(dates), -1, dtype=np.int64)
+    for p, rows in enumerate(period_slices(dates, years)):
+        number[rows] = p
+    return number
+
+
+def grouped_counts(types, group, n_groups, n_types):
+    """Counts (member, group, type) of a member matrix with one bincount.
+
+    group -> group number of every row (0 ... n_groups-1, -1 = not counted)
+    Types outside 1..n_types and NaN days are not counted.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    n_members = types.shape[1]
+    member = np.arange(n_members)[None, :]
+    valid = (group[:, None] >= 0) & (types >= 1) & (types <= n_types) & (types != missing)
+    index = ((member * n_groups + group[:, None]) * n_types + types.astype(np.int64) - 1)
+    counts = np.bincount(index[valid], minlength=n_members * n_groups * n_types)
+    return counts.reshape(n_members, n_groups, n_types)
+
+
+def seasonal_counts(types, dates, n_types=None, years=(periods['past'], periods['future'])):
+    """Counts (period, member, season, type) of a (n_days, n_members) member matrix."""
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        n_types = int(types[types != missing].max(initial=0))
+    n_seasons = len(seasons)
+
+    period = period_numbers(dates, years)
+    group = np.where(period >= 0, period * n_seasons + index_of(dates).season, -1)
+    counts = grouped_counts(types, group, len(years) * n_seasons, n_types)
+    counts = counts.reshape(types.shape[1], len(years), n_seasons, n_types)
+    return counts.transpose(1, 0, 2, 3)
+
+
+def annual_counts(types, dates, n_types=None, years=None):
+    """Counts (member, year, season, type) for every year of a range (default: all years).
+
+    Returns the counts and the years; December is counted in winter of its own
+    calendar year, as in the trend figures of the R scripts.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        n_types = int(types[types != missing].max(initial=0))
+    if years is None:
+        years = (int(dates[0, 0]), int(dates[-1, 0]))
+    n_seasons = len(seasons)
+    n_years = years[1] - years[0] + 1
+
+    year = dates[:, 0].astype(np.int64) - years[0]
+    inside = (year >= 0) & (year < n_years)
+    group = np.where(inside, year * n_seasons + season_of_month(dates[:, 1]), -1)
+    counts = grouped_counts(types, group, n_years * n_seasons, n_types)
+    return (counts.reshape(types.shape[1], n_years, n_seasons, n_types),
+            np.arange(years[0], years[1] + 1))
+
+
+def frequencies(types, dates, n_types=None, years=(periods['past'], periods['future'])):
+    """Seasonal frequencies of all members and periods and their change in one call.
+
+    Returns a dict with arrays (period, member, season, type)
+        counts      -> number of days
+        mean_annual -> number of days per year, i.e. counts / number of years
+        relative    -> % of the valid days of that member, period and season
+    and arrays (member, season, type) for the change of the last vs. the first period
+        change         -> change of the mean annual number of days
+        change_percent -> change in % of the frequency in the first period
+    """
+    return summary(seasonal_counts(types, dates, n_types, years), years)
+
+
+def summary(counts, years):
+    """Days per year, relative frequency and change from counts (period, ..., type)."""
+    n_years = np.array([y[1] - y[0] + 1 for y in years], dtype=float)
+    mean_annual = counts / n_years.reshape((-1,) + (1,) * (counts.ndim - 1))
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.where(total > 0, counts / total * 100, np.nan)
+        change = mean_annual[-1] - mean_annual[0]
+        change_percent = np.where(mean_annual[0] > 0, change / mean_annual[0] * 100, np.nan)
+    return {'counts': counts, 'mean_annual': mean_annual, 'relative': relative,
+            'change': change, 'change_percent': change_percent}
+
+
+def write_table(result, filename, members=None):
+    """Write past/future frequencies and their change as a long table for R (read.table)."""
+    past, future = result['mean_annual'][0], result['mean_annual'][-1]
+    if members is None:
+        members = ['e%02d' % (i + 1) for i in range(past.shape[0])]
+    with open(filename, 'w') as f:
+        f.write('member season type past future change change_percent '
+                'relative_past relative_future\n')
+        for m, s, t in np.ndindex(*past.shape):
+            f.write('%s %s %d %.6g %.6g %.6g %.6g %.6g %.6g\n' % (
+                members[m], seasons[s], t + 1, past[m, s, t], future[m, s, t],
+                result['change'][m, s, t], result['change_percent'][m, s, t],
+                result['relative'][0, m, s, t], result['relative'][-1, m, s, t]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python frequency.py cost_matrix.dat output.txt')
+    starttime = datetime.now() # start stopwatch
+    dates, types, names = cost_parser.read(sys.argv[1])
+    result = frequencies(types, dates)
+    write_table(result, sys.argv[2], names)
+    print(str(result['counts'].shape) + ' frequencies written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
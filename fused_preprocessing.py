@@ -0,0 +1,59 @@
+# Purpose: Fused preprocessing of one model member for cost733class, replacing the chain
+#          mergetime -> selyear/sellevel/sellonlatbox/invertlat -> ncap2 -> ncks -> ncwa of
+#          merging_cmip5.py (and subset -> ncks -> ncap2 of preprocessing_cesm.py), which writes
+#          a full copy of the data after every step
+#          (1) the source files (e.g. all historical and rcp85 files of a realisation) are read
+#              in time order through virtual_dataset.py, only the hyperslab of the selected
+#              level, years and the Central European box is read, in chunks of time steps
+#          (2) in memory: latitude inversion, level set to 0 (as cdo setlevel,0), time
+#              re-encoded to hours since 1900-01-01 in the calendar of the model, bnds
+#              variables dropped; time steps already written (overlapping files) are skipped
+#              as in cdo mergetime
+#          (3) only the final file is written, in netCDF classic format
+#          usage: python fused_preprocessing.py output.nc variable level|none source.nc ...
+#                 e.g. python fused_preprocessing.py zg_no_bnds.nc zg 50000 zg_day_*.nc
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from datetime import datetime # package for stopping time
+from virtual_dataset import VirtualDataset # time-concatenated view over the source files
+
+region = (2.5, 20., 40.73, 52.10) # lon_min, lon_max, lat_min, lat_max (as sellonlatbox)
+years = (1960, 2099)
+time_units = 'hours since 1900-01-01 00:00:00'
+script = os.path.abspath(__file__) # for the stages of the preprocessing scripts
+
+
+def fuse(sources, output, variable, level=None, years=years, region=region, invert=True):
+    """Write the cost733class input of one member from its source files in one pass.
+
+    level is the value of the level coordinate to keep (e.g. 50000 Pa), None for variables
+    without levels. Returns the number of time steps written.
+    """
+    dataset = VirtualDataset(sources, variable)
+    return dataset.write(output, years, region, level, invert, time_units=time_units,
+                         level_value=0, format='NETCDF3_CLASSIC')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        sys.exit('usage: python fused_preprocessing.py output.nc variable level|none '
+                 'source.nc [source.nc ...]')
+    starttime = datetime.now() # start stopwatch
+    level = None if sys.argv[3] == 'none' else float(sys.argv[3])
+    # written to a temporary name first, so an interrupted run does not leave an output
+    # file which the stage pipeline would take as done
+    tmp = sys.argv[1] + '.tmp'
+    n = fuse(sys.argv[4:], tmp, sys.argv[2], level)
+    os.replace(tmp, sys.argv[1])
+    print(sys.argv[1] + ': ' + str(n) + ' time steps')
+    print(datetime.now() - starttime)
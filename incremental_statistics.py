@@ -0,0 +1,214 @@
+# Purpose: Incremental frequency and persistence statistics, so a refreshed WTC file (or a
+#          longer model run) only costs the time of the new days instead of a recomputation
+#          of the whole record
+#          (1) the state on disk (npz) holds per member the counts (year, season, type), the
+#              run-length histogram (year, type, season, length) with every run counted in the
+#              year of its first day, and the run which is still open at the last date
+#          (2) appending new days counts them, finds their runs with persistence.py and
+#              stitches the first run to the open run if the dates are consecutive, the
+#              season and the type are the same; runs ending before the last new day are
+#              closed, the run reaching the last new day becomes the new open run
+#          (3) frequencies, period histograms (open run included) and the annual counts as
+#              trend input are read from the state for any year range
+#          note: runs crossing the first day of a period are counted in full in the year they
+#          start in, not cut at the period edge as in persistence.period_histograms()
+#          usage: python incremental_statistics.py state.npz new_days.dat [max_length]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+import frequency
+import persistence
+from calendar_conversion import seasons, season_of_month
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import day_numbers, periods
+
+state_version = 1
+default_max_length = 20 # bins of the run-length histogram, as in the R scripts (+ overflow)
+
+
+def new_state(names, n_types, max_length=default_max_length, calendar='gregorian'):
+    """Empty state for a matrix with the given member names and number of types."""
+    n_members = len(names)
+    return {'version': state_version, 'names': np.array(names), 'n_types': int(n_types),
+            'max_length': int(max_length), 'calendar': calendar, 'first_year': 0,
+            'last_date': np.zeros((0, 3), dtype=np.int16),
+            'counts': np.zeros((n_members, 0, len(seasons), n_types), dtype=np.int64),
+            'runs': np.zeros((n_members, 0, n_types, len(seasons), max_length),
+                             dtype=np.int64),
+            'open_type': np.zeros(n_members, dtype=np.int64), # 0 = no open run
+            'open_length': np.zeros(n_members, dtype=np.int64),
+            'open_year': np.zeros(n_members, dtype=np.int64)}
+
+
+def years_of(state):
+    """(first, last) year of the state, None if it is still empty."""
+    n_years = state['counts'].shape[1]
+    if n_years == 0:
+        return None
+    return (state['first_year'], state['first_year'] + n_years - 1)
+
+
+def extend_years(state, last_year):
+    """Add empty years to the counts and histograms up to last_year."""
+    missing_years = last_year - (state['first_year'] + state['counts'].shape[1] - 1)
+    if missing_years > 0:
+        pad = [(0, 0)] * 5
+        pad[1] = (0, missing_years)
+        state['counts'] = np.pad(state['counts'], pad[:4])
+        state['runs'] = np.pad(state['runs'], pad)
+
+
+def append(state, dates, types):
+    """Add new days (dates (n, 3), types (n, n_members)) to the state, in place.
+
+    Days up to the last date of the state are skipped, so a whole refreshed file can be
+    given as well. Returns the number of days added.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if types.shape[1] != len(state['names']):
+        raise ValueError('expected ' + str(len(state['names'])) + ' members, got ' +
+                         str(types.shape[1]))
+    calendar = str(state['calendar'])
+    if len(state['last_date']):
+        new = day_numbers(dates, calendar) > day_numbers(state['last_date'], calendar)[0]
+        dates, types = dates[new], types[new]
+    n_days, n_members = types.shape
+    if n_days == 0:
+        return 0
+    if np.any((types != missing) & (types > state['n_types'])):
+        raise ValueError('circulation types larger than the ' + str(state['n_types']) +
+                         ' types of the state')
+
+    # counts per year
+    if years_of(state) is None:
+        state['first_year'] = int(dates[0, 0])
+    extend_years(state, int(dates[-1, 0]))
+    years = years_of(state)
+    state['counts'] += frequency.annual_counts(types, dates, state['n_types'], years)[0]
+
+    # runs of the new days, the first one possibly continuing the open run
+    runs = persistence.find_runs(types, dates, calendar)
+    at_end = runs['start'] + runs['length'] == n_days # run reaching the last new day
+    open_run = state['open_length'] > 0
+    consecutive = False
+    if len(state['last_date']):
+        last = state['last_date']
+        consecutive = (day_numbers(dates[:1], calendar)[0] -
+                       day_numbers(last, calendar)[0] == 1 and
+                       season_of_month(dates[0, 1]) == season_of_month(last[0, 1]))
+    stitch = open_run & consecutive & (types[0].astype(np.int64) == state['open_type'])
+    first = np.flatnonzero(runs['start'] == 0) # first run of every member with a valid day 0
+    first = first[stitch[runs['member'][first]]]
+    runs['length'][first] += state['open_length'][runs['member'][first]]
+    runs['year'][first] = state['open_year'][runs['member'][first]]
+
+    # open runs that were not continued are closed now, the runs at the end stay open
+    closed = open_runs(state, open_run & ~stitch)
+    for key in ('type', 'length', 'year'):
+        state['open_' + key][:] = 0
+        state['open_' + key][runs['member'][at_end]] = runs[key][at_end]
+
+    done = {key: np.r_[runs[key][~at_end], closed[key]] for key in closed}
+    state['runs'] += persistence.yearly_histogram(done, n_members, state['n_types'], years,
+                                                  state['max_length'])
+    state['last_date'] = np.asarray(dates[-1:], dtype=np.int16)
+    return n_days
+
+
+def open_runs(state, selected=None):
+    """Open runs (all or selected members) as run list: member, type, length, year, season."""
+    if selected is None:
+        selected = state['open_length'] > 0
+    member = np.flatnonzero(selected)
+    season = season_of_month(state['last_date'][0, 1]) if len(member) else 0
+    return {'member': member, 'type': state['open_type'][member],
+            'length': state['open_length'][member], 'year': state['open_year'][member],
+            'season': np.full(len(member), season, dtype=np.int64)}
+
+
+def annual_counts(state):
+    """Trend input: counts (member, year, season, type) and the years."""
+    years = years_of(state) or (state['first_year'], state['first_year'] - 1)
+    return state['counts'], np.arange(years[0], years[1] + 1)
+
+
+def yearly_runs(state):
+    """Run-length histogram (member, year, type, season, length) including the open runs."""
+    years = years_of(state)
+    if years is None:
+        return state['runs'].copy()
+    return state['runs'] + persistence.yearly_histogram(
+        open_runs(state), len(state['names']), state['n_types'], years, state['max_length'])
+
+
+def year_rows(state, years):
+    """Slice of the year axis of the state for a year range (first, last)."""
+    first = state['first_year']
+    n_years = state['counts'].shape[1]
+    return slice(min(max(years[0] - first, 0), n_years), min(max(years[1] - first + 1, 0),
+                                                             n_years))
+
+
+def frequencies(state, years=(periods['past'], periods['future'])):
+    """Seasonal frequencies (period, member, season, type) as frequency.frequencies()."""
+    counts = np.stack([state['counts'][:, year_rows(state, y)].sum(axis=1) for y in years])
+    return frequency.summary(counts, years)
+
+
+def period_histograms(state, years=(periods['past'], periods['future'])):
+    """Run-length histograms (period, member, type, season, length) of year ranges."""
+    runs = yearly_runs(state)
+    return np.stack([runs[:, year_rows(state, y)].sum(axis=1) for y in years])
+
+
+def save_state(state, filename):
+    np.savez(filename, **state)
+
+
+def load_state(filename):
+    with np.load(filename) as data:
+        state = {key: data[key] for key in data.files}
+    if int(state['version']) != state_version:
+        raise ValueError(filename + ' has state version ' + str(int(state['version'])) +
+                         ', expected ' + str(state_version))
+    for key in ('version', 'n_types', 'max_length', 'first_year'):
+        state[key] = int(state[key])
+    state['calendar'] = str(state['calendar'])
+    return state
+
+
+def update_file(state_file, filename, max_length=default_max_length, calendar='gregorian'):
+    """Append the days of a text file to a state file (created if it does not exist yet)."""
+    dates, types, names = cost_parser.read(filename)
+    if os.path.exists(state_file):
+        state = load_state(state_file)
+    else:
+        n_types = int(types[types != missing].max(initial=0))
+        state = new_state(names, n_types, max_length, calendar)
+    n_days = append(state, dates, types)
+    save_state(state, state_file)
+    return state, n_days
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python incremental_statistics.py state.npz new_days.dat [max_length]')
+    starttime = datetime.now() # start stopwatch
+    max_length = int(sys.argv[3]) if len(sys.argv) > 3 else default_max_length
+    state, n_days = update_file(sys.argv[1], sys.argv[2], max_length)
+    print(str(n_days) + ' days added, ' + sys.argv[1] + ' covers ' + str(years_of(state)))
+    print(datetime.now() - starttime)
@@ -0,0 +1,104 @@
+# Purpose: Streaming insertion of leap days into cost733class output of models with a
+#          365 day calendar (CESM12-LE and the no-leap CMIP5 models)
+#          (1) read the classification output line by line
+#          (2) insert in each 4th block of 365 days, i.e. a leap year, a 'nan' line at a
+#              random position within that year
+#          (3) write the extended output directly, no temporary x{n}.dat block files
+#          the random position is drawn from a seedable random number generator so that
+#          reruns give exactly the same extended files
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import random # package for random numbers
+from datetime import datetime # package for stopping time
+
+block_length = 365   # number of days in one model year
+leap_fill = 'nan '   # content of the inserted leap day line, i.e. a missing circulation type
+
+
+def member_rng(seed, name):
+    """Random number generator for one ensemble member.
+
+    The generator is seeded with the global seed and the file name, so each member gets
+    its own reproducible sequence independent of the order in which files are processed.
+    With seed = None the generator is seeded from the system, as in the old scripts.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random(str(seed) + '_' + name) # string seeds are hashed deterministically
+
+
+def insert_leap_days(lines, rng, first_leap_block=0):
+    """Generator yielding the lines of a 365 day series with a leap day line inserted.
+
+    Every 4th block of 365 lines, starting with block 'first_leap_block', gets a
+    'nan' line inserted after N lines of that block, where N is a random integer
+    between 1 and 365 (as randint(1,365) did in the old block file version).
+    """
+    position = 0      # line number inside the current block
+    block = 0         # block number, i.e. model year counted from the first year
+    insert_at = None  # position of the leap day in the current block (None: no leap year)
+
+    for line in lines:
+        if position == 0 and (block - first_leap_block) % 4 == 0:
+            insert_at = rng.randint(1, block_length) # draw leap day position for this year
+        elif position == 0:
+            insert_at = None
+
+        yield line.rstrip('\n') + '\n'
+        position += 1
+
+        if position == insert_at: # insert leap day after N lines of that year
+            yield leap_fill + '\n'
+
+        if position == block_length: # start a new block/year
+            position = 0
+            block += 1
+
+    # a last incomplete leap year block gets its leap day appended at the end
+    # (list.insert() in the old version did the same with an index larger than the list)
+    if position > 0 and insert_at is not None and insert_at > position:
+        yield leap_fill + '\n'
+
+
+def extend_file(path_in, path_out, seed=None, first_leap_block=0):
+    """Stream one cost733class output file into its leap day extended version."""
+    if os.path.abspath(path_in) == os.path.abspath(path_out):
+        raise ValueError('input and output file are the same: ' + path_in)
+
+    rng = member_rng(seed, os.path.basename(path_in))
+    with open(path_in, 'r') as f_in, open(path_out, 'w') as f_out:
+        f_out.writelines(insert_leap_days(f_in, rng, first_leap_block))
+
+
+def extend_files(filenames, path_in, path_out=None, seed=None, replace=('small', 'extended')):
+    """Insert leap days into all given files (e.g. all 84 CESM members) in one call.
+
+    The output file name is the input file name with replace[0] substituted by replace[1];
+    files without replace[0] in their name get the suffix '_extended' instead.
+    """
+    if path_out is None:
+        path_out = path_in
+
+    out_names = []
+    for f in sorted(filenames):
+        print(f)
+        starttime = datetime.now() # start stopwatch
+
+        if replace[0] in f:
+            out_name = f.replace(replace[0], replace[1])
+        else:
+            out_name = f[:-4] + '_' + replace[1] + f[-4:]
+        extend_file(os.path.join(path_in, f), os.path.join(path_out, out_name), seed)
+        out_names.append(out_name)
+
+        print(datetime.now() - starttime) # print time it takes for one file
+    return out_names
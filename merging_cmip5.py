@@ -21,11 +21,20 @@ cdo = Cdo()
 import os
 from datetime import datetime
 import sys
+import functools
+import glob
+import parallel_driver # process pool over (model, realisation)
+import stage_pipeline # overlapping stages of several realisations
+import fused_preprocessing # all preprocessing steps in one pass
 #cdo.debug = True
 
 variable = 'zg'
+level = '50000' # 500 hPa
 method = 'GWT'
 classes = '10'
+# True: steps (2)-(7) in one pass with fused_preprocessing.py, which only writes the final file;
+# False: cdo/NCO chain writing a full copy of the data after every step
+fused = True
 
 # file paths
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -46,7 +55,8 @@ path_cost='/net/h2o/climphys/hmaurice/Practicum_meteoswiss_output/cost/cmip5/'
 a = ['GFDL-ESM2M']; 
 b = ['r1i1p1']
 
-## all CMIP5 model list
+## all CMIP5 model list (the 365_day and the 360_day HadGEM2 models get their leap days
+## in leap_day_cmip5.py afterwards)
 #a = ['ACCESS1-3',       'CanESM2',    
 #      'CMCC-CMS',      'GFDL-CM3',     'HadGEM2-AO',    'IPSL-CM5A-MR', 
 #      'MIROC-ESM-CHEM',  'MRI-CGCM3',   'bcc-csm1-1',    'CCSM4',      'CNRM-CM5',  
@@ -55,110 +65,139 @@ b = ['r1i1p1']
 #      'MIROC5',        'MPI-ESM-MR',      'NorESM1-M']
 #b = ['r1i1p1', 'r2i1p1', 'r3i1p1', 'r4i1p1', 'r12i1p1']
 
+# (model, realisation) jobs for parallel_driver.py, stage_pipeline.py and work_queue.py
+job_list = parallel_driver.jobs(a, b)
+
+
+# number of parallel processes per stage in the pipeline (I/O heavy stages are limited to a
+# few processes, cost733class is CPU heavy and gets one process per core)
+limits = {'mergetime': 2, 'subset': 2, 'ncap2': 4, 'ncks': 4, 'ncwa': 4, 'fused': 2,
+          'cost733class': os.cpu_count() or 1}
+
 
 # example filename: zg_day_GFDL-ESM2M_historical_r1i1p1_20010101-20051231.nc
-for model in a:                 # loop over all models
-    for realisation in b:       # loop over all realisations
-        # combine array elements
-        s = path_hist + variable + '/' + model + '/' + realisation + '/'
-        t = path_rcp + variable + '/' + model + '/' + realisation + '/'
-        output_name = 'zg_day_' + model + '_historical_rcp85_' + realisation + '.nc'
-
-        # (1) check if data exists
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # print 'No data' for model realisations that do not exist
-        if os.path.isdir(s) == False and os.path.isdir(t) == False or \
-           os.path.isdir(s) == True and os.path.isdir(t) == False:
-            print('No data for: ' + model + '/' + realisation)
-            continue
-        
-        starttime = datetime.now() # start stopwatch
-
-        # (2) merge all historical and rcp85 files
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # now use cdo merge for that file path
-        cdo.mergetime(input = s + 'zg_day_*', output = path_processed + 'zg_day_' + model + 
-                      '_' + realisation + '_historical.nc', force = False)
-        cdo.mergetime(input = t + 'zg_day_*', output = path_processed + 'zg_day_' + model +
-                      '_' + realisation + '_rcp85.nc', force = False)
-
-        # (3) merge newly created hist + rcp85 file into one large file
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        filenames = [i for i in os.listdir(path_processed) if 
-                     i.startswith('zg_day_' + model + '_' + realisation)]
-        print(filenames) # print filenames in console
-        cdo.mergetime(input = ' '.join(filenames), output = path_processed + output_name, 
-                      force = False)
-        print('Merging hist + rcp85 data done:')
-        print(datetime.now() - starttime) # print time after one iteration
-
-        # (4) subsetting data to reduce size
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        cdo.invertlat(input = '-setlevel,0 -sellevel,50000 -selname,zg -selyear,1960/2099 \
-        -sellonlatbox,2.5,20,40.73,52.10 ' + path_processed + output_name, 
-                      output = output_name[:-3] + '_process.nc', force = False)
-        print('Subsetting data done:')
-        print(datetime.now() - starttime) # print time after one iteration
-
-        # (5) adjusting time dimension
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        output_name = output_name[:-3] + '_process.nc'
-        os.system("ncap2 -O -s " + '"time=time*24+50*365" ' + '-s ' + "'time@units=" + 
-                  '"hours since 1900-01-01 00:00:00' + '"' + "' " + path_processed + 
-                  output_name + ' ' + path_processed + output_name.replace('process', 'time')) 
-                  # cannot use force = False here as system() does not take keyword arguments
-
-        # (6) convert to classic format
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        output_name = output_name.replace('process', 'time')
-        os.system('ncks -O --fl_fmt=classic ' + path_processed + output_name + ' ' + 
-                  path_processed + output_name.replace('time', 'classic'))
-
-        # (7) removing bnds = 2 dimension from the vertical zg dimension
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        output_name = output_name.replace('time', 'classic')
-        os.system('ncwa -a bnds ' + path_processed + output_name + ' ' + path_processed + 
-                  output_name.replace('classic', 'no_bnds')) 
-
-        
-        # (8) running cost software and creating output .dat file
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        output_name = output_name.replace('classic', 'no_bnds')
-        os.system("cost733class -dat pth:" + path_processed + output_name + " var:" + 
-                  variable + " -met " + method + " -ncl " + classes + " -cla " + 
-                  path_processed + output_name[:-3].replace('no_bnds', 'cost') + 
-                  ".dat" + " -dcol 3  -cnt")
-
-
-        # (9) removing redundant files
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        os.system('rm -r ' + path_processed + 'zg_day_' + model + '_' + realisation + '_*')
-        redundant_names = 'zg_day_' + model + '_historical_rcp85_' + realisation  
-        os.system('rm -r ' + path_processed + redundant_names + '_classic.nc')
-        os.system('rm -r ' + path_processed + redundant_names + '_no_bnds.nc')
-        os.system('rm -r ' + path_processed + redundant_names + '_process.nc')
-        os.system('rm -r ' + path_processed + redundant_names + '_time.nc')
-        
-        print(datetime.now() - starttime) # print time after one iteration
-        
-        # (10) post-processing cost output file
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-#        output_name = output_name[:-3].replace('no_bnds', 'cost') + '.dat'
-#        print(output_name)
-#        os.system("awk '{print $4}' " + path_processed + output_name + ' >' + 
-#                  path_processed + output_name.replace('cost', 'small'))
-#        os.system('rm -r ' + path_processed + output_name) # again remove redundant file 
-        # these 'small' files are then used to adjust leap days and combinedd into one file
-        # with date vector (i.e. YYYY MM DD) and all other CMIP5 ensemble member output
-        # to combine these files I just use: hmaurice@h2o:~> paste date.dat zg_day_* >data.dat
-
-   # end of loop over realisations
-# end of loop over models
-
-sys.exit() # exit script
+def member_stages(model, realisation, workdir):
+    """Stages (name, argv commands, output) for one model realisation, None if no data.
+
+    Intermediate files go to workdir, the cost733class output to path_cost.
+    """
+    # combine array elements
+    s = path_hist + variable + '/' + model + '/' + realisation + '/'
+    t = path_rcp + variable + '/' + model + '/' + realisation + '/'
+    output_name = 'zg_day_' + model + '_historical_rcp85_' + realisation + '.nc'
+    work = workdir + '/' # all intermediate files of this realisation
+
+    # (1) check if data exists
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # print 'No data' for model realisations that do not exist
+    if os.path.isdir(s) == False and os.path.isdir(t) == False or \
+       os.path.isdir(s) == True and os.path.isdir(t) == False:
+        print('No data for: ' + model + '/' + realisation)
+        return None
+
+    # (2) merge all historical and rcp85 files
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    historical = work + 'zg_day_' + model + '_' + realisation + '_historical.nc'
+    rcp85 = work + 'zg_day_' + model + '_' + realisation + '_rcp85.nc'
+    merge = [['cdo', '-O', 'mergetime'] + sorted(glob.glob(s + 'zg_day_*')) + [historical],
+             ['cdo', '-O', 'mergetime'] + sorted(glob.glob(t + 'zg_day_*')) + [rcp85]]
+
+    # (3) merge newly created hist + rcp85 file into one large file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    merged = work + output_name
+    merge.append(['cdo', '-O', 'mergetime', historical, rcp85, stage_pipeline.partial(merged)])
+
+    # (4) subsetting data to reduce size
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    process = work + output_name[:-3] + '_process.nc'
+    subset = ['cdo', '-O', 'invertlat', '-setlevel,0', '-sellevel,50000', '-selname,zg',
+              '-selyear,1960/2099', '-sellonlatbox,2.5,20,40.73,52.10', merged,
+              stage_pipeline.partial(process)]
+
+    # (5) adjusting time dimension
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    time = work + output_name[:-3] + '_time.nc'
+    ncap2 = ['ncap2', '-O', '-s', 'time=time*24+50*365',
+             '-s', 'time@units="hours since 1900-01-01 00:00:00"', process,
+             stage_pipeline.partial(time)]
+
+    # (6) convert to classic format
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    classic = work + output_name[:-3] + '_classic.nc'
+    ncks = ['ncks', '-O', '--fl_fmt=classic', time, stage_pipeline.partial(classic)]
+
+    # (7) removing bnds = 2 dimension from the vertical zg dimension
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    no_bnds = work + output_name[:-3] + '_no_bnds.nc'
+    ncwa = ['ncwa', '-O', '-a', 'bnds', classic, stage_pipeline.partial(no_bnds)]
+
+    # (8) running cost software and creating output .dat file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # runs inside workdir, so files cost733class writes to its CWD stay with this realisation
+    cost = path_cost + output_name[:-3] + '_cost.dat'
+    cost733 = ['cost733class', '-dat', 'pth:' + no_bnds, 'var:' + variable, '-met', method,
+               '-ncl', classes, '-cla', stage_pipeline.partial(cost), '-dcol', '3', '-cnt']
+
+    # (9) removing redundant files
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # all intermediate files are in workdir, which is removed after success
+
+    # a stage is skipped if its output exists (as force = False), e.g. after a restart, and
+    # a realisation with an existing cost733class output is not processed again
+    if os.path.exists(cost):
+        return []
+    if fused: # the source files are read once, only no_bnds is written
+        fuse = [sys.executable, fused_preprocessing.script, stage_pipeline.partial(no_bnds),
+                variable, level] + \
+               sorted(glob.glob(s + 'zg_day_*')) + sorted(glob.glob(t + 'zg_day_*'))
+        return [('fused', [fuse], no_bnds), ('cost733class', [cost733], cost)]
+    return [('mergetime', merge, merged), ('subset', [subset], process),
+            ('ncap2', [ncap2], time), ('ncks', [ncks], classic), ('ncwa', [ncwa], no_bnds),
+            ('cost733class', [cost733], cost)]
+
+
+def process_member(model, realisation, workdir):
+    """Run all stages of one model realisation, returns a message if it is skipped."""
+    starttime = datetime.now() # start stopwatch
+    stages = member_stages(model, realisation, workdir)
+    if stages is None:
+        return 'no data'
+    stage_pipeline.run_stages(stages, cwd = workdir)
+    print(model + '/' + realisation + ' done after ' + str(datetime.now() - starttime))
+
+    # (10) post-processing cost output file
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#    output_name = output_name[:-3].replace('no_bnds', 'cost') + '.dat'
+#    print(output_name)
+#    os.system("awk '{print $4}' " + path_processed + output_name + ' >' + 
+#              path_processed + output_name.replace('cost', 'small'))
+#    os.system('rm -r ' + path_processed + output_name) # again remove redundant file 
+    # these 'small' files are then used to adjust leap days and combinedd into one file
+    # with date vector (i.e. YYYY MM DD) and all other CMIP5 ensemble member output
+    # to combine these files I use assemble_ensemble.py (checks the length of each member
+    # and writes the member names in column order to data.dat.members):
+    # hmaurice@h2o:~> python assemble_ensemble.py date.dat data.dat zg_day_*
+
+
+if __name__ == '__main__':
+    # python merging_cmip5.py [number of workers] -> process pool, one realisation per worker
+    # python merging_cmip5.py pipeline            -> all realisations as one stage pipeline, so
+    #                                                mergetime of the next realisations overlaps
+    #                                                with cost733class of the previous ones
+    workroot = path_processed + 'work'
+    if len(sys.argv) > 1 and sys.argv[1] == 'pipeline':
+        stage_pipeline.run({(model, realisation): functools.partial(member_stages, model,
+                                                                    realisation)
+                            for model, realisation in job_list},
+                           limits, workroot = workroot)
+    else:
+        n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else parallel_driver.default_workers
+        parallel_driver.run(process_member, job_list, n_workers,
+                            workroot = workroot)
+    sys.exit() # exit script
 
 # (XY) notes here
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
@@ -0,0 +1,93 @@
+# Purpose: Parallel driver for the (model, realisation) loops of merging_cmip5.py and
+#          preprocessing_cmip5_maps_data.py, which are independent and mostly wait for
+#          CDO/NCO/cost733class subprocesses
+#          (1) every (model, realisation) pair is one job, run in a process pool with a
+#              configurable number of workers
+#          (2) every job gets its own working directory (<workroot>/<model>_<realisation>)
+#              for all intermediate files, so the clean-up of one job cannot remove the files
+#              of another one; the directory is deleted after a successful job and kept after
+#              a failure for inspection
+#          (3) progress and failures are collected in the main process; a failed job does not
+#              stop the others and all failures are listed (with traceback) at the end and in
+#              <workroot>/failures.txt
+#          usage: from a script, run(process_member, jobs(models, realisations), n_workers)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime # package for stopping time
+
+default_workers = 4 # CDO is memory hungry, do not use all cores by default
+
+
+def jobs(models, realisations):
+    """All (model, realisation) pairs in the order of the original loops."""
+    return [(model, realisation) for model in models for realisation in realisations]
+
+
+def workdir_of(workroot, job):
+    return os.path.join(workroot, '_'.join(job))
+
+
+def _run_job(function, job, workdir):
+    """Run one job in its working directory, returns (status, message, duration)."""
+    starttime = datetime.now() # start stopwatch
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        message = function(*job, workdir=workdir)
+    except Exception:
+        return 'failed', traceback.format_exc(), datetime.now() - starttime
+    return 'done' if message is None else 'skipped', message, datetime.now() - starttime
+
+
+def run(function, job_list, n_workers=default_workers, workroot='work', keep=False):
+    """Run function(model, realisation, workdir=...) for all jobs in a process pool.
+
+    The function returns None when done or a message (e.g. 'no data') when it skipped the
+    job; exceptions are failures. Returns a dict {job: (status, message, duration)}.
+    """
+    workroot = os.path.abspath(workroot)
+    os.makedirs(workroot, exist_ok=True)
+    starttime = datetime.now() # start stopwatch
+    results = {}
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = {pool.submit(_run_job, function, job, workdir_of(workroot, job)): job
+                   for job in job_list}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                status, message, duration = future.result()
+            except Exception: # e.g. worker process killed
+                status, message, duration = 'failed', traceback.format_exc(), None
+            results[job] = (status, message, duration)
+            if status != 'failed' and not keep:
+                shutil.rmtree(workdir_of(workroot, job), ignore_errors=True)
+            print('[' + str(len(results)) + '/' + str(len(job_list)) + '] ' + ' '.join(job) +
+                  ': ' + status + ('' if duration is None else ' after ' + str(duration)) +
+                  ('' if status != 'skipped' else ' (' + str(message) + ')'))
+
+    report(results, job_list, workroot)
+    print(datetime.now() - starttime)
+    return results
+
+
+def report(results, job_list, workroot):
+    """Print the summary and the failures and write them to <workroot>/failures.txt."""
+    failed = [job for job in job_list if results[job][0] == 'failed']
+    with open(os.path.join(workroot, 'failures.txt'), 'w') as f:
+        for job in failed:
+            f.write(' '.join(job) + '\n' + results[job][1] + '\n')
+    print(str(len(job_list) - len(failed)) + ' of ' + str(len(job_list)) + ' jobs finished, ' +
+          str(len(failed)) + ' failed (' + os.path.join(workroot, 'failures.txt') + ')')
+    for job in failed:
+        print(' '.join(job) + ':\n' + results[job][1])
@@ -0,0 +1,159 @@
+# Purpose: Vectorized run-length (persistence) engine for all ensemble members, circulation
+#          types and seasons at once, replacing the nested loops over members, types, seasons
+#          and rows in Fig1_persistence_measure_circulation_type.R
+#          (1) find all runs of consecutive days with the same circulation type in one pass
+#              over the member matrix; a run ends where the type changes, at a NaN leap day,
+#              at the edge of a season and where the dates are not consecutive (e.g. at the
+#              edge of the selected period)
+#          (2) count the runs in a dense (member, type, season, run length) histogram, where
+#              run length 1 is bin 0; with max_length the last bin collects all runs of
+#              max_length days or longer (the R scripts silently lost runs > 20 days),
+#              without max_length the histogram is as long as the longest run
+#          usage: python persistence.py cost_..._Z500.dat output.npz [max_length]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+from calendar_conversion import seasons, season_of_month
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import day_numbers, period_slices, periods
+
+
+def find_runs(types, dates, calendar='gregorian'):
+    """All runs of the same circulation type in a (n_days, n_members) uint8 matrix.
+
+    dates    -> (n_days, 3) YYYY MM DD of the rows, chronologically sorted
+    calendar -> 'gregorian' or 'noleap', decides which dates are consecutive
+    Returns a dict of 1D arrays (one entry per run): member, start (row), length, type,
+    season and year (of the first day). Runs of NaN days are not returned.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    n_days, n_members = types.shape
+    if n_days == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {'member': empty, 'start': empty, 'length': empty, 'type': empty,
+                'season': empty, 'year': empty}
+
+    # a new run starts on day i if one of these is true (same for all members)
+    season = season_of_month(dates[:, 1])
+    edge = np.ones(n_days, dtype=bool)
+    edge[1:] = (np.diff(day_numbers(dates, calendar)) != 1) | (season[1:] != season[:-1])
+
+    # member-major layout: member j occupies rows j*n_days ... (j+1)*n_days-1
+    flat = np.ascontiguousarray(types.T).ravel()
+    start = np.tile(edge, n_members)
+    start[1:] |= flat[1:] != flat[:-1]
+    start |= flat == missing # every NaN day is a run of its own and is dropped below
+    start = np.flatnonzero(start)
+    length = np.diff(np.r_[start, flat.size])
+
+    run_type = flat[start]
+    keep = run_type != missing
+    start, length, run_type = start[keep], length[keep], run_type[keep]
+    member, row = np.divmod(start, n_days)
+    return {'member': member, 'start': row, 'length': length,
+            'type': run_type.astype(np.int64), 'season': season[row],
+            'year': dates[row, 0].astype(np.int64)}
+
+
+def run_histogram(runs, n_members, n_types, max_length=None):
+    """Dense (member, type, season, length) histogram of the runs from find_runs().
+
+    Circulation type t goes into index t-1 (types outside 1..n_types are ignored), a run
+    of l days into bin l-1. With max_length the histogram has max_length bins and the last
+    one counts all runs with max_length or more days (overflow bin).
+    """
+    length = runs['length']
+    if max_length is None:
+        max_length = int(length.max(initial=1))
+    keep = (runs['type'] >= 1) & (runs['type'] <= n_types)
+    n_seasons = len(seasons)
+    index = ((runs['member'][keep] * n_types + runs['type'][keep] - 1) * n_seasons +
+             runs['season'][keep]) * max_length + np.minimum(length[keep], max_length) - 1
+    counts = np.bincount(index, minlength=n_members * n_types * n_seasons * max_length)
+    return counts.reshape(n_members, n_types, n_seasons, max_length)
+
+
+def yearly_histogram(runs, n_members, n_types, years, max_length):
+    """Histogram (member, year, type, season, length) with runs counted in their first year.
+
+    years -> (first, last) year of the year axis, runs starting outside are ignored
+    The last of the max_length bins is an overflow bin as in run_histogram().
+    """
+    n_years = years[1] - years[0] + 1
+    year = runs['year'] - years[0]
+    keep = (runs['type'] >= 1) & (runs['type'] <= n_types) & (year >= 0) & (year < n_years)
+    n_seasons = len(seasons)
+    index = ((((runs['member'][keep] * n_years + year[keep]) * n_types +
+               runs['type'][keep] - 1) * n_seasons + runs['season'][keep]) * max_length +
+             np.minimum(runs['length'][keep], max_length) - 1)
+    counts = np.bincount(index, minlength=n_members * n_years * n_types * n_seasons *
+                         max_length)
+    return counts.reshape(n_members, n_years, n_types, n_seasons, max_length)
+
+
+def histogram(types, dates, n_types=None, max_length=None, calendar='gregorian'):
+    """Run-length histogram (member, type, season, length) of a member matrix."""
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        valid = types[types != missing]
+        n_types = int(valid.max(initial=0))
+    runs = find_runs(types, dates, calendar)
+    return run_histogram(runs, types.shape[1], n_types, max_length)
+
+
+def period_histograms(types, dates, n_types=None, max_length=None, calendar='gregorian',
+                      years=(periods['past'], periods['future'])):
+    """Histograms (period, member, type, season, length) for several year ranges.
+
+    The runs are cut at the edges of each period as in the R scripts. Without max_length
+    all periods get as many bins as the longest run in any of them.
+    """
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        n_types = int(types[types != missing].max(initial=0))
+
+    all_runs = []
+    for rows in period_slices(dates, years):
+        all_runs.append(find_runs(types[rows], dates[rows], calendar))
+    if max_length is None:
+        max_length = max([int(r['length'].max(initial=1)) for r in all_runs])
+    return np.stack([run_histogram(r, types.shape[1], n_types, max_length)
+                     for r in all_runs])
+
+
+def histogram_file(filename, n_types=None, max_length=None, calendar='gregorian',
+                   years=(periods['past'], periods['future'])):
+    """Past/future histograms of a cost733class matrix file, see period_histograms()."""
+    dates, types, names = cost_parser.read(filename)
+    return period_histograms(types, dates, n_types, max_length, calendar, years), names
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python persistence.py cost_matrix.dat output.npz [max_length]')
+    starttime = datetime.now() # start stopwatch
+    max_length = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    counts, names = histogram_file(sys.argv[1], max_length=max_length)
+    # counts: (period, member, type, season, run length) with period = past, future
+    np.savez(sys.argv[2], counts=counts, members=names, seasons=seasons,
+             periods=np.array([periods['past'], periods['future']]),
+             overflow=max_length is not None) # last bin = runs >= max_length days
+    print(str(counts.shape) + ' histogram written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
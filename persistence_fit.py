@@ -0,0 +1,117 @@
+# Purpose: Batched persistence measure, i.e. the regression fit log(y) = a + b*x of the
+#          distribution of consecutive-day periods (Fig. 1), for every period, member,
+#          circulation type and season in one vectorized call
+#          (1) take the run-length histograms from persistence.py, shape (..., run length)
+#          (2) relative frequency y in % of the seasonal total (or of a reference total, e.g.
+#              the past period as in the R scripts) and x = run length in days
+#          (3) closed-form weighted least squares on log(y) of all bins with y > 0; weights
+#              are the run counts (variance of log(count) ~ 1/count) or uniform as in lm()
+#          (4) slope b (persistence measure), intercept a, R^2, standard error of b and the
+#              number of bins used; cells with fewer than two bins get NaN
+#          usage: python persistence_fit.py histograms.npz fit.npz [fit.txt]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+from calendar_conversion import seasons
+
+
+def relative_frequency(counts, reference=None):
+    """Run counts (..., length) in % of their total or of a reference total (...)."""
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1) if reference is None else np.asarray(reference, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total[..., None] > 0, counts / total[..., None] * 100, 0.)
+
+
+def fit(counts, weights='counts', reference=None, overflow=False, min_length=1):
+    """Fit log(y) = a + b*x for every cell of a run-length histogram at once.
+
+    counts     -> run counts (..., n_lengths), bin k holds runs of k+1 days
+    weights    -> 'counts' (weighted by the run counts) or 'uniform' (as lm() in R)
+    reference  -> totals (...) the frequencies are relative to (default: own total)
+    overflow   -> True if the last bin is an overflow bin (runs >= n_lengths days); it is
+                  left out of the fit as it does not belong to a single run length
+    min_length -> shortest run length used in the fit (e.g. 2 to leave out 1-day periods)
+    Returns a dict with arrays of shape (...): slope, intercept, r2, stderr, n.
+    """
+    counts = np.asarray(counts, dtype=float)
+    n_lengths = counts.shape[-1]
+    x = np.arange(1, n_lengths + 1, dtype=float)
+
+    y = relative_frequency(counts, reference)
+    used = (counts > 0) & (x >= min_length)
+    if overflow:
+        used[..., -1] = False
+    if weights == 'counts':
+        w = np.where(used, counts, 0.)
+    elif weights == 'uniform':
+        w = used.astype(float)
+    else:
+        raise ValueError('unknown weights: ' + str(weights))
+    with np.errstate(divide='ignore'):
+        logy = np.where(used, np.log(np.where(used, y, 1.)), 0.)
+
+    # weighted sums over the run length axis
+    s = w.sum(axis=-1)
+    sx = w @ x
+    sxx = w @ (x * x)
+    sy = (w * logy).sum(axis=-1)
+    sxy = (w * logy) @ x
+    syy = (w * logy * logy).sum(axis=-1)
+    n = used.sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vxx = sxx - sx * sx / s      # weighted sum of squares of x around its mean
+        vxy = sxy - sx * sy / s
+        vyy = syy - sy * sy / s
+        slope = vxy / vxx
+        intercept = (sy - slope * sx) / s
+        ss_res = np.maximum(vyy - slope * vxy, 0.)
+        r2 = np.where(vyy > 0, 1 - ss_res / vyy, 1.)
+        stderr = np.sqrt(ss_res / (n - 2) / vxx) # standard error of the slope
+
+    bad = n < 2
+    slope[bad] = intercept[bad] = r2[bad] = np.nan
+    stderr[n < 3] = np.nan
+    return {'slope': slope, 'intercept': intercept, 'r2': r2, 'stderr': stderr, 'n': n}
+
+
+def write_table(result, filename, members=None, periods=('past', 'future')):
+    """Write a (period, member, type, season) fit as a long table for R (read.table)."""
+    shape = result['slope'].shape
+    if members is None:
+        members = ['e%02d' % (i + 1) for i in range(shape[1])]
+    with open(filename, 'w') as f:
+        f.write('period member type season slope intercept r2 stderr n\n')
+        for index in np.ndindex(*shape):
+            p, m, t, s = index
+            f.write('%s %s %d %s %.6g %.6g %.6g %.6g %d\n' % (
+                periods[p], members[m], t + 1, seasons[s], result['slope'][index],
+                result['intercept'][index], result['r2'][index], result['stderr'][index],
+                result['n'][index]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python persistence_fit.py histograms.npz fit.npz [fit.txt]')
+    starttime = datetime.now() # start stopwatch
+    data = np.load(sys.argv[1])
+    counts = data['counts'] # (period, member, type, season, length) from persistence.py
+    # frequencies relative to the past seasonal total for both periods, as in Fig. 1
+    overflow = bool(data['overflow']) if 'overflow' in data.files else False
+    result = fit(counts, reference=counts[0].sum(axis=-1)[None], overflow=overflow)
+    np.savez(sys.argv[2], members=data['members'], **result)
+    if len(sys.argv) > 3:
+        write_table(result, sys.argv[3], [str(m) for m in data['members']])
+    print(str(result['slope'].shape) + ' fits written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
@@ -18,12 +18,18 @@ cdo = Cdo()
 import os
 from datetime import datetime
 import sys
+import parallel_driver # process pool over the member files
+import stage_pipeline # stages as argv lists
+import fused_preprocessing # all preprocessing steps in one pass
 #cdo.debug = True
 
 # variables
 method = 'GWT'
 classes = '10'
 variable = 'Z500'            # Z500 or psl
+# True: steps (1)-(5) in one pass with fused_preprocessing.py, which only writes the 'time' file;
+# False: cdo/NCO chain writing a full copy of the data after every step
+fused = True
 
 # file paths
 path_ensembles='/net/bio/climphys/fischeer/CMIP5/EXTREMES/CESM12-LE/'
@@ -37,14 +43,19 @@ path_cost='/net/h2o/climphys/hmaurice/Practicum_meteoswiss_output/cost/cesm/'
 filenames = [i for i in os.listdir(path_ensembles) if i.startswith('z500_psl_CESM12-LE_historical_')
              and i.endswith('1940-2099.nc')]
 
+# (file, variable) jobs, one ensemble member file each, see process_member()
+job_list = [(f, variable) for f in sorted(filenames)]
+
 # ~~~ pre-processing procedure with cdo ~~~ #
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
- 
-# create for loop (content inside the loop needs to be indented)
-for f in filenames:
-    print(f)                                          # print filenames out
-    starttime = datetime.now()                        # start counting time
-    
+
+def member_stages(f, variable, workdir):
+    """Stages (name, argv commands, output) for one ensemble member file.
+
+    Intermediate files go to workdir, the cost733class output to path_cost.
+    """
+    work = workdir + '/'
+
     # script runs from inside out:
     # (1) select variable name, i.e. Z500
           # cdo selname ifile ofile
@@ -57,37 +68,22 @@ for f in filenames:
     #     westerlies are classified as easterlies and vice versa
           # cdo invertlat ifile ofile
     # finally, write output in specified folder and replace a part of the filename
-    
-    cdo.invertlat(input = '-sellonlatbox,2.5,20,40.73,52.10 -selyear,1960/2099 ' +
-                  path_ensembles + f, output = path_processed + f.replace('psl', 'processed'), 
-                  force = False) # force = False -> skip those files which are already done
+    processed = work + f.replace('psl', 'processed')
+    subset = ['cdo', '-O', 'invertlat', '-sellonlatbox,2.5,20,40.73,52.10', '-selyear,1960/2099',
+              path_ensembles + f, stage_pipeline.partial(processed)]
 
     # (5) rewrite netcdf4 into classic format
-    # execute string as bash command with os.system()
-    os.system("ncks -3 " + path_processed + f.replace('psl', 'processed') + " " + 
-              path_processed + f.replace('psl', 'classic'))
-    os.system("rm -r " + path_processed + f.replace('psl', 'processed')) # remove redundant file
-
+    classic = work + f.replace('psl', 'classic')
+    ncks = ['ncks', '-O', '-3', processed, stage_pipeline.partial(classic)]
 
     # (5) adjust time@unit in classic format (tip from Urs' email on 02/10/2018, 10:06 CET
-    os.system("ncap2 -O -s " + '"time=time*24+50*365" ' + '-s ' + "'time@units=" + 
-              '"hours since 1900-01-01 00:00:00' + '"' + "' " + path_processed + 
-              f.replace('psl', 'classic') + " " + path_processed + f.replace('psl', 'time'))
-    os.system("rm -r " + path_processed + f.replace('psl', 'classic')) # again remove redundant file
-
     # the cost input file now has the suffix 'time'
+    time = work + f.replace('psl', 'time')
+    ncap2 = ['ncap2', '-O', '-s', 'time=time*24+50*365',
+             '-s', 'time@units="hours since 1900-01-01 00:00:00"', classic,
+             stage_pipeline.partial(time)]
 
-    print(datetime.now() - starttime)         # print time it takes to execute script for one file
-    
-# ~~~ running the cost733class software ~~~ #
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
-
-filenames2 = [i for i in os.listdir(path_processed) if 
-              i.startswith('z500_time_CESM12-LE_historical_') and i.endswith('1940-2099.nc')]
-
-# create for loop 
-for f2 in filenames2:
-    print(f2)
+    # ~~~ running the cost733class software ~~~ #
     # -dat pth:/../.. -> specify input location
     # var:Z500 -> specify which of the variables it needs to consider
     # -met GWT -ncl 10 -> specify classification method and how many patterns
@@ -95,30 +91,57 @@ for f2 in filenames2:
     # specify output direction and write as a .dat file
     # -dcol 3 -> write time in the first three columns, i.e. YYYY MM DD 
     # -cnt -> I don't know what that means
-    os.system("cost733class -dat pth:" + path_processed + f2 + " var:" + variable + " -met " + 
-              method + " -ncl " + classes + " -cla " + path_cost + 
-              f2[:-3].replace('time', 'cost') + "_" + variable + ".dat" + " -dcol 3 -cnt")
-
-
-# ~~~ post-processing the .dat files in folder cost ~~~ #
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
-
-# here I extract the output without the date columns, i.e. cut the 4th column
-path_cost = '/net/h2o/climphys/hmaurice/Practicum_meteoswiss_output/cost/cesm/'
-filenames3 = [i for i in os.listdir(path_cost) if i.startswith('z500_cost_')]
-
-for f in filenames3:
-    print(f)
-    starttime = datetime.now()
+    cost = path_cost + os.path.basename(time)[:-3].replace('time', 'cost') + "_" + variable + \
+           ".dat"
+    cost733 = ['cost733class', '-dat', 'pth:' + time, 'var:' + variable, '-met', method,
+               '-ncl', classes, '-cla', stage_pipeline.partial(cost), '-dcol', '3', '-cnt']
+
+    # a stage is skipped if its output exists (as force = False -> skip those files which are
+    # already done); intermediate files are removed together with workdir
+    if fused: # the member file is read once, only the cost733class input is written
+        fuse = [sys.executable, fused_preprocessing.script, stage_pipeline.partial(time),
+                variable, 'none', path_ensembles + f]
+        return [('fused', [fuse], time), ('cost733class', [cost733], cost)]
+    return [('subset', [subset], processed), ('ncks', [ncks], classic),
+            ('ncap2', [ncap2], time), ('cost733class', [cost733], cost)]
+
+
+def small_file(cost):
+    """Write the 4th column (weather type) of a cost733class output file to the 'small' file
+    and remove the cost file (same as awk '{print $4}' cost > small; rm cost)."""
     # column1  column2  column3  column4
     # year     month    day      # weather type
-    os.system("awk '{print $4}' " + path_cost + f + " >" + path_cost + f.replace('cost', 'small'))
-
-    os.system("rm -r " + path_cost + f) # again remove redundant files    
-    # these 'small' files are then used to adjust leap days and combined into one file with date
-    # vectors and all ensemble member output
-    # hmaurice@h2o:~> paste date.dat z500_small_* >data.dat
-
-
+    small = os.path.join(os.path.dirname(cost), os.path.basename(cost).replace('cost', 'small'))
+    with open(cost) as fin, open(small + '.tmp', 'w') as fout:
+        for line in fin:
+            columns = line.split()
+            fout.write((columns[3] if len(columns) > 3 else '') + '\n')
+    os.replace(small + '.tmp', small)
+    os.remove(cost) # again remove redundant files
+    return small
+
+
+def process_member(f, variable, workdir):
+    """Preprocess, classify and post-process one ensemble member file in workdir."""
+    print(f)                                          # print filenames out
+    starttime = datetime.now()                        # start counting time
+    stages = member_stages(f, variable, workdir)
+    small = path_cost + os.path.basename(stages[-1][2]).replace('cost', 'small')
+    if os.path.exists(small):
+        return 'already done'
+    stage_pipeline.run_stages(stages, cwd = workdir)
+
+    # ~~~ post-processing the .dat files in folder cost ~~~ #
+    # here I extract the output without the date columns, i.e. cut the 4th column
+    small_file(stages[-1][2])
+    # these 'small' files are then used to adjust leap days (leap_day_cesm.py) and combined
+    # into one file with date vectors and all ensemble member output with assemble_ensemble.py
+    # hmaurice@h2o:~> python assemble_ensemble.py date.dat data.dat z500_extended_*
+    print(datetime.now() - starttime)         # print time it takes to execute script for one file
 
 
+if __name__ == '__main__':
+    # all member files in a process pool (python preprocessing_cesm.py [number of workers])
+    # or, on several nodes, with work_queue.py
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else parallel_driver.default_workers
+    parallel_driver.run(process_member, job_list, n_workers, workroot = path_processed + 'work')
@@ -22,6 +22,16 @@ cdo = Cdo()
 import os # operating system
 from datetime import datetime # package for stopping time
 import sys
+import parallel_driver # process pool over (model, realisation)
+import virtual_dataset # hist + rcp85 files without merged copies
+import cdo_planner # cheaper order of the cdo operators
+import regrid_weights # bilinear remapping with cached weights
+import seasonal_anomalies # tas climatology without temporary files
+import contextlib
+import multiprocessing
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 #cdo.debug = True
 
 # file paths
@@ -30,6 +40,13 @@ path_hist='/net/atmos/data/cmip5/historical/day/' # input file path 1
 path_rcp='/net/atmos/data/cmip5/rcp85/day/'       # input file path 2
 # file path for processed files
 path_output='/net/h2o/climphys/hmaurice/Practicum_meteoswiss_output/patterns/cmip5_data_for_spatial_maps/'
+# 1x1 ERA-Interim target grid, absolute path as the jobs run in their own directories
+grid = os.path.abspath('grid.nc')
+# True: remapbil + sellonlatbox in Python with the weights cached per model grid
+# (regrid_weights.py), False: cdo computes the weights for every variable and period
+in_process = True
+io_limit = 2 # variables of a realisation reading/writing the shared file system at once
+_io = None # semaphore of io_limit, shared by the variable processes (see process_member)
 
 # variables
 variable = ['zg','psl','pr','tas'] # geopotential height, pressure at sea level, ...
@@ -47,195 +64,249 @@ a = ['ACCESS1-0', 'ACCESS1-3', 'BNU-ESM', 'CanESM2', 'CMCC-CM', 'CMCC-CMS',
 #b = ['r1i1p1']
 b = ['r1i1p1', 'r2i1p1', 'r3i1p1', 'r4i1p1', 'r12i1p1'] # realisations
 
+# (model, realisation) jobs for parallel_driver.py and work_queue.py
+job_list = parallel_driver.jobs(a, b)
+
+
+def io():
+    """Context of a read or write of the shared file system (io_limit at the same time)."""
+    return _io if _io is not None else contextlib.nullcontext()
+
+
+def _init_worker(semaphore):
+    global _io
+    _io = semaphore
+
+
+def chain(var, first, last):
+    """cdo operators of a variable and period, in order of application."""
+    operators = [('selyear', str(first) + '/' + str(last))]
+    if var == 'zg': # select 500 hPa level, set that level to 0
+        operators += [('sellevel', '50000'), ('setlevel', '0')]
+    return operators + [('remapbil', grid), ('sellonlatbox', '-20,40,30,80')]
+
+
+def plan_chain(dataset, first, last, workdir, checked):
+    """(years, level, box, rest, weights, level_value) of the (planned) chain of a variable
+    and period; weights is the Regridder if the rest runs in Python, else None.
+
+    checked holds the results of the comparisons on the sample for this variable.
+    """
+    var = dataset.variable
+    work = workdir + '/'
+
+    # reordered chain (selections first, pre-crop before remapbil), used only if it gives the
+    # same result as the original chain on the first two time steps
+    original = chain(var, first, last)
+    planned = cdo_planner.plan(original, cdo_planner.resolution(dataset.lon, dataset.lat))
+    sample = work + var + '_sample.nc'
+    if 'planned' not in checked:
+        with io():
+            cdo.seltimestep('1/2', input = dataset.files[0], output = sample, force = False)
+        checked['planned'] = cdo_planner.equivalent(original, planned, sample, workdir)
+        if not checked['planned']:
+            print(var + ': reordered chain differs, using the original order')
+    used = planned if checked['planned'] else original
+    years, level, box, rest = cdo_planner.split(used)
+
+    # remapbil and sellonlatbox (after setlevel) in Python with weights cached per model grid,
+    # if that gives the same result as cdo on the sample
+    operators = [op[0] for op in rest]
+    if in_process and operators[-2:] == ['remapbil', 'sellonlatbox'] and \
+       operators[:-2] in ([], ['setlevel']) and rest[-2][1] == grid:
+        level_value = float(rest[0][1]) if operators[0] == 'setlevel' else None
+        _, _, lon, lat = dataset.coordinates(box)
+        weights = regrid_weights.weights(lon, lat, grid,
+                                         tuple(float(x) for x in rest[-1][1].split(',')))
+        if 'weights' not in checked:
+            checked['weights'] = regrid_weights.matches_cdo(used, sample, var, weights, box,
+                                                            level, level_value, workdir)
+            if not checked['weights']:
+                print(var + ': regridding differs from cdo, using cdo')
+        if checked['weights']:
+            return years, level, box, rest, weights, level_value
+    return years, level, box, rest, None, None
+
+
+def regrid(dataset, first, last, output, workdir, checked):
+    """Run the (planned) chain of a variable and period into output."""
+    if os.path.exists(output): # as force = False
+        return
+    years, level, box, rest, weights, level_value = plan_chain(dataset, first, last, workdir,
+                                                               checked)
+    if weights is not None:
+        dataset.write(output + '.tmp', years, box, level, level_value = level_value,
+                      remap = weights)
+        os.replace(output + '.tmp', output)
+        return
+
+    # the leading selections are read from the model files, the rest runs in cdo
+    region = workdir + '/' + os.path.basename(output)[:-3] + '_region.nc'
+    if not os.path.exists(region):
+        dataset.write(region + '.tmp', years, box, level)
+        os.replace(region + '.tmp', region)
+    with io():
+        cdo_planner.run(rest, region, output)
+
+
+def tas_anomalies(dataset, name, workdir, checked):
+    """Seasonal anomalies of tas relative to the 1988-2017 climatology for both periods.
+
+    With the regridding in Python the climatology is accumulated in one pass over the past
+    and subtracted while the periods are written (no temporary files), otherwise the periods
+    are regridded to temporary files and cdo yseassub is used.
+    """
+    outputs = {(1988, 2017): path_output + name + '_1988-2017.nc',
+               (2070, 2099): path_output + name + '_2070-2099.nc'}
+    if all(os.path.exists(output) for output in outputs.values()): # as force = False
+        return
+    plans = {period: plan_chain(dataset, period[0], period[1], workdir, checked)
+             for period in outputs}
+    if all(p[4] is not None for p in plans.values()):
+        years, level, box, rest, weights, level_value = plans[(1988, 2017)]
+        climatology = seasonal_anomalies.SeasonalClimatology(dataset.units, dataset.calendar)
+        for values, block in dataset.blocks(years, box, level):
+            climatology.add(values, weights(block, dataset.fill), dataset.fill)
+        for period, output in outputs.items():
+            years, level, box, rest, weights, level_value = plans[period]
+            dataset.write(output + '.tmp', years, box, level, level_value = level_value,
+                          remap = weights, transform = climatology.subtract)
+            os.replace(output + '.tmp', output)
+        return
+
+    work = workdir + '/'
+    regrid(dataset, 1988, 2017, work + name + '_past.nc', workdir, checked)
+    regrid(dataset, 2070, 2099, work + name + '_future.nc', workdir, checked)
+    with io():
+        cdo.yseassub(input = work + name + '_past.nc' + ' -yseasavg ' +
+                     work + name + '_past.nc', output = outputs[(1988, 2017)], force=False)
+        cdo.yseassub(input = work + name + '_future.nc' + ' -yseasavg ' +
+                     work + name + '_past.nc', output = outputs[(2070, 2099)], force=False)
+
+
+def process_variable(model, realisation, var, workdir):
+    """Remap and subset one variable of a model realisation for both periods.
+
+    The intermediate files are in workdir/var and removed when the variable is done.
+    """
+    starttime = datetime.now() # start stopwatch
+    vardir = os.path.join(workdir, var)
+    os.makedirs(vardir, exist_ok = True)
+
+    # time-concatenated view over all historical and rcp85 files: instead of cdo mergetime of
+    # all chunks and of hist + rcp85 (two global copies), only the years of a period, the level
+    # and the padded box are read from the original files (virtual_dataset.py)
+    member = '/' + model + '/' + realisation
+    with io():
+        dataset = virtual_dataset.VirtualDataset(
+            virtual_dataset.source_files(path_hist + var + member, var) +
+            virtual_dataset.source_files(path_rcp + var + member, var), var, io = io())
+    checked = {}
+    name = var + '_day_' + model + '_' + realisation
+
+    # (3) subset data and extract only what I need
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # for zg:        - select past (1988-2017) and future (2070-2099) data
+    #                - select 500 hPa level, set that level to 0
+    #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
+    # for psl and pr: - select past (1988-2017) and future (2070-2099) data
+    #                 - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
+    if var != 'tas':
+        regrid(dataset, 1988, 2017, path_output + name + '_1988-2017.nc', vardir, checked)
+        regrid(dataset, 2070, 2099, path_output + name + '_2070-2099.nc', vardir, checked)
+
+    # for tas:       - select past (1988-2017) and future (2070-2099) data
+    #                - detrend data
+    #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
+    #                - subtract seasonal average of past period from past and future data
+    #                  to calculate the anomalies, the seasonal average accumulated while
+    #                  reading the past (seasonal_anomalies.py); only if the regridding runs
+    #                  in cdo via temporary files with ending *_past.nc and *_future.nc
+    else:
+        tas_anomalies(dataset, name, vardir, checked)
+
+    # removing redundant files
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # only the intermediate files of this variable (*_region.nc, *_past.nc, *_future.nc), the
+    # other variables of the realisation may still be running
+    shutil.rmtree(vardir, ignore_errors = True)
+    print(model + '_' + realisation + ' ' + var + ' done after ' +
+          str(datetime.now() - starttime))
+
+
+def process_member(model, realisation, workdir):
+    """Remap and subset zg, psl, pr and tas of one model realisation, the four variables in
+    parallel processes (process_variable).
+
+    Intermediate files go to workdir, the 1988-2017 and 2070-2099 files to path_output.
+    Returns None when done or a message if the realisation is skipped.
+    """
+    # combine array elements to build strings for filepaths
+    # path for geopotential height data
+    c = path_hist + variable[0] + '/' + model + '/' + realisation + '/'
+    d = path_rcp + variable[0] + '/' + model + '/' + realisation + '/'
+    # path for sea level pressure data
+    e = path_hist + variable[1] + '/' + model + '/' + realisation + '/'
+    f = path_rcp + variable[1] + '/' + model + '/' + realisation + '/'
+    # path for precipitation data
+    g = path_hist + variable[2] + '/' + model + '/' + realisation + '/'
+    h = path_rcp + variable[2] + '/' + model + '/' + realisation + '/'
+    # path for surface air temperature data
+    i = path_hist + variable[3] + '/' + model + '/' + realisation + '/'
+    k = path_rcp + variable[3] + '/' + model + '/' + realisation + '/'
+
+    # (1) check if data exists
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # print 'No data' for model realisations that do not exist
+    # check if historical data does not exist or if rcp85 data does not exist 
+    # -> if true, then skip iteration in loop and continue with next realisation or model
+    if os.path.isdir(c) == False and os.path.isdir(d) == False or \
+       os.path.isdir(c) == True and os.path.isdir(d) == False or \
+       os.path.isdir(e) == True and os.path.isdir(f) == False or \
+       os.path.isdir(e) == False and os.path.isdir(f) == False or \
+       os.path.isdir(g) == True and os.path.isdir(h) == False or \
+       os.path.isdir(g) == False and os.path.isdir(h) == False or \
+       os.path.isdir(i) == True and os.path.isdir(k) == False or \
+       os.path.isdir(i) == False and os.path.isdir(k) == False:
+        print('Data missing for: ' + model + '_' + realisation) # print statement
+        return 'data missing' # skip realisation if at least one statement is true
 
-for model in a:                 # loop over all models
-    for realisation in b:       # loop over all realisations
-        # combine array elements to build strings for filepaths
-        # path for geopotential height data
-        c = path_hist + variable[0] + '/' + model + '/' + realisation + '/'
-        d = path_rcp + variable[0] + '/' + model + '/' + realisation + '/'
-        # path for sea level pressure data
-        e = path_hist + variable[1] + '/' + model + '/' + realisation + '/'
-        f = path_rcp + variable[1] + '/' + model + '/' + realisation + '/'
-        # path for precipitation data
-        g = path_hist + variable[2] + '/' + model + '/' + realisation + '/'
-        h = path_rcp + variable[2] + '/' + model + '/' + realisation + '/'
-        # path for surface air temperature data
-        i = path_hist + variable[3] + '/' + model + '/' + realisation + '/'
-        k = path_rcp + variable[3] + '/' + model + '/' + realisation + '/'
-
-        output_name = 'zg_psl_pr_tas__' + model + '_historical_rcp85_' + realisation + '.nc'
-
-        # (1) check if data exists
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # print 'No data' for model realisations that do not exist
-        # check if historical data does not exist or if rcp85 data does not exist 
-        # -> if true, then skip iteration in loop and continue with next realisation or model
-        if os.path.isdir(c) == False and os.path.isdir(d) == False or \
-           os.path.isdir(c) == True and os.path.isdir(d) == False or \
-           os.path.isdir(e) == True and os.path.isdir(f) == False or \
-           os.path.isdir(e) == False and os.path.isdir(f) == False or \
-           os.path.isdir(g) == True and os.path.isdir(h) == False or \
-           os.path.isdir(g) == False and os.path.isdir(h) == False or \
-           os.path.isdir(i) == True and os.path.isdir(k) == False or \
-           os.path.isdir(i) == False and os.path.isdir(k) == False:
-            print('Data missing for: ' + model + '_' + realisation) # print statement
-            continue # skip iteration if at least one statement in loop is true
-
-            
-        starttime = datetime.now() # start stopwatch
-
-        # (2) merge all historical and rcp85 files
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # now use cdo merge for that file path
-        # zg: geopotential height
-        cdo.mergetime(input = c + 'zg_day_*', output = path_output + 'zg_day_historical_' + 
-                      model + '_' + realisation + '.nc', force = False)
-        cdo.mergetime(input = d + 'zg_day_*', output = path_output + 'zg_day_rcp85_' + 
-                      model + '_' + realisation + '.nc', force = False)
-
-        # psl: pressure at sea level
-        cdo.mergetime(input = e + 'psl_day_*', output = path_output + 'psl_day_historical_' + 
-                      model + '_' + realisation + '.nc', force = False)
-        cdo.mergetime(input = f + 'psl_day_*', output = path_output + 'psl_day_rcp85_' + 
-                      model + '_' + realisation + '.nc', force = False)
-
-        # pr: precipitation
-        cdo.mergetime(input = g + 'pr_day_*', output = path_output + 'pr_day_historical_' + 
-                      model + '_' + realisation + '.nc', force = False)
-        cdo.mergetime(input = h + 'pr_day_*', output = path_output + 'pr_day_rcp85_' + 
-                      model + '_' + realisation + '.nc', force = False)
-
-        # tas: standard reference temperature
-        cdo.mergetime(input = i + 'tas_day_*', output = path_output + 'tas_day_historical_' + 
-                      model + '_' + realisation + '.nc', force = False)
-        cdo.mergetime(input = k + 'tas_day_*', output = path_output + 'tas_day_rcp85_' +
-                      model + '_' + realisation + '.nc', force = False)
-
-        # (3) merge newly created hist + rcp85 file into one large file
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        filenames = [i for i in os.listdir(path_output) if 
-                     i.startswith('zg_day_historical_' + model) or 
-                     i.startswith('zg_day_rcp85_' + model)]
-        name = 'zg_day_historical_rcp85_' + model + '_' + realisation + '.nc'
-
-        cdo.mergetime(input = ' '.join(filenames), output = path_output + name, force=False)
         
-        # (4) subset data and extract only what I need
-        # for zg:        - select past (1988-2017) and future (2070-2099) data
-        #                - select 500 hPa level, set that level to 0
-        #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
-        cdo.sellonlatbox(-20,40,30,80, input = 
-                         '-remapbil,grid.nc -setlevel,0 -sellevel,50000 -selyear,1988/2017 ' + 
-                         path_output + name, output = path_output + 
-                         name[:-3].replace('_historical_rcp85_','_') + 
-                         '_1988-2017.nc', force = False)
-        cdo.sellonlatbox(-20,40,30,80, input = 
-                         '-remapbil,grid.nc -setlevel,0 -sellevel,50000 -selyear,2070/2099 ' + 
-                         path_output + name, output = path_output + 
-                         name[:-3].replace('_historical_rcp85_','_') + 
-                         '_2070-2099.nc', force = False)
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        filenames = [i for i in os.listdir(path_output) if 
-                     i.startswith('psl_day_historical_' + model) or 
-                     i.startswith('psl_day_rcp85_' + model)]
-        name = 'psl_day_historical_rcp85_' + model + '_' + realisation + '.nc'
-
-        cdo.mergetime(input = ' '.join(filenames), output = path_output + name, force=False)
-        
-        # for psl:       - select past (1988-2017) and future (2070-2099) data
-        #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
-        cdo.sellonlatbox(-20,40,30,80, input = '-remapbil,grid.nc -selyear,1988/2017 ' + 
-                         path_output + name, output = path_output + 
-                         name[:-3].replace('_historical_rcp85_','_') + 
-                         '_1988-2017.nc', force=False)
-        cdo.sellonlatbox(-20,40,30,80, input = '-remapbil,grid.nc -selyear,2070/2099 ' + 
-                         path_output + name, output = path_output + 
-                         name[:-3].replace('_historical_rcp85_','_') +
-                         '_2070-2099.nc', force=False)
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        filenames = [i for i in os.listdir(path_output) if 
-                     i.startswith('pr_day_historical_' + model) or 
-                     i.startswith('pr_day_rcp85_' + model)]
-        name = 'pr_day_historical_rcp85_' + model + '_' + realisation + '.nc'
-
-        cdo.mergetime(input = ' '.join(filenames), output = path_output + name, force=False)
-
-        # for pr:        - select past (1988-2017) and future (2070-2099) data
-        #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
-        cdo.sellonlatbox(-20,40,30,80, input = '-remapbil,grid.nc -selyear,1988/2017 ' + 
-                         path_output + name, 
-                         output = path_output + name[:-3].replace('_historical_rcp85_','_') + 
-                         '_1988-2017.nc', force=False)
-        cdo.sellonlatbox(-20,40,30,80, input = '-remapbil,grid.nc -selyear,2070/2099 ' + 
-                         path_output + name, 
-                         output = path_output + name[:-3].replace('_historical_rcp85_','_') + 
-                         '_2070-2099.nc', force=False)
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        filenames = [i for i in os.listdir(path_output) if 
-                     i.startswith('tas_day_historical_' + model) or 
-                     i.startswith('tas_day_rcp85_' + model)]
-        name = 'tas_day_historical_rcp85_' + model + '_' + realisation + '.nc'
-
-        cdo.mergetime(input = ' '.join(filenames), output = path_output + name, force=False)
-
-        # for tas:       - select past (1988-2017) and future (2070-2099) data
-        #                - detrend data
-        #                - bilinearly remap/interpolate to 1x1 ERA-Interim grid with file grid.nc
-        #                - create temporary file with ending *_past.nc and *_future.nc
-        #                - subtract seasonal average of past period from past and future data
-        #                  to calculate the anomalies
-        cdo.sellonlatbox(-20,40,30,80, input ='-remapbil,grid.nc -selyear,1988/2017 ' + 
-                     path_output + name, output = path_output + name[:-3] + 
-                     '_past.nc', force=False)
-        cdo.yseassub(input = path_output + name[:-3] + '_past.nc' + ' -yseasavg ' + 
-                     path_output + name[:-3] + '_past.nc', output = path_output + 
-                     name[:-3].replace('_historical_rcp85_','_') + '_1988-2017.nc', force=False)
-
-        cdo.sellonlatbox(-20,40,30,80, input ='-remapbil,grid.nc -selyear,2070/2099 ' + 
-                     path_output + name, output = path_output + 
-                     name[:-3] + '_future.nc', force=False)
-        cdo.yseassub(input = path_output + name[:-3] + '_future.nc' + ' -yseasavg ' + 
-                     path_output + name[:-3] + '_past.nc', output = path_output + 
-                     name[:-3].replace('_historical_rcp85_','_') + '_2070-2099.nc', force=False)
-
-        # merging together of all four files (zg, psl, pr and tas) unfortunately does not work
-        # as geopotential height still has the lev dimension inside the netcdf file
-        print('Merging hist + rcp85 data and subsetting done:')
-        print(datetime.now() - starttime) # print time after one iteration
-
-
-        # removing redundant files
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        os.system('rm -r *' + realisation + '.nc') # remove all files except the ones I need
-        os.system('rm -r *past.nc')
-        os.system('rm -r *future.nc')
-
-        print('All done for: ' + model + '_' + realisation)
-        print(datetime.now() - starttime) # print time after one iteration
-        
-
-   # end of loop over realisations
-# end of loop over models
-
-
-
-
-
-
-
-
-
-
-
-
-sys.exit() # exit script
+    starttime = datetime.now() # start stopwatch
+
+    # (2) the four variables are independent, every one runs in its own process with its own
+    # working directory; reading and writing the shared file system is limited to io_limit
+    # variables at the same time
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    semaphore = multiprocessing.BoundedSemaphore(io_limit)
+    failed = []
+    with ProcessPoolExecutor(len(variable), initializer = _init_worker,
+                             initargs = (semaphore,)) as pool:
+        futures = {pool.submit(process_variable, model, realisation, var, workdir): var
+                   for var in variable}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                failed.append(futures[future] + ':\n' + traceback.format_exc())
+    if failed: # the working directories of the failed variables are kept
+        raise RuntimeError('failed variables of ' + model + '_' + realisation + '\n' +
+                           '\n'.join(failed))
+
+    # merging together of all four files (zg, psl, pr and tas) unfortunately does not work
+    # as geopotential height still has the lev dimension inside the netcdf file
+    print('All done for: ' + model + '_' + realisation)
+    print(datetime.now() - starttime) # print time after one iteration
+
+
+if __name__ == '__main__':
+    # loop over all models and realisations in a process pool, one working directory per
+    # realisation: python preprocessing_cmip5_maps_data.py [number of workers]
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else parallel_driver.default_workers
+    parallel_driver.run(process_member, job_list, n_workers,
+                        workroot = path_output + 'work')
+    sys.exit() # exit script
 
 
 # (XY) notes here
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,185 @@
+# Purpose: Bilinear regridding of the maps preprocessing (cdo remapbil,grid.nc followed by
+#          sellonlatbox) in Python with cached interpolation weights, instead of cdo computing
+#          the weights again for every variable, period and realisation of a model
+#          (1) the weights from a regular lon/lat source grid to the points of the target grid
+#              (grid.nc) within the box are a sparse matrix (target points x source points)
+#              with at most four entries per row, computed with vectorized interval searches
+#          (2) the matrices are cached in memory and as .npz files, keyed by a hash of the
+#              source grid and a hash of the target grid points, so all variables, periods and
+#              realisations of a model on the same grid share one matrix
+#          (3) a block of time steps is regridded with one sparse matrix product (source
+#              points x time steps); a target point with a missing source value among its
+#              corners is missing (as in cdo)
+#          (4) matches_cdo compares the result with cdo on a sample before it is used
+#          usage: from a script, weights(lon, lat, grid, box) and VirtualDataset.write(...,
+#                 remap=weights); python regrid_weights.py source.nc grid.nc [box]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import hashlib
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import scipy.sparse
+from netCDF4 import Dataset
+import cdo_planner # cdo commands and comparison of the outputs
+import virtual_dataset # box selection as cdo sellonlatbox
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regrid_cache')
+_cache = {} # weights already loaded in this process
+
+
+def grid_hash(lon, lat):
+    """Short hash of the coordinates of a lon/lat grid."""
+    digest = hashlib.sha1(np.asarray(lon, dtype='f8').tobytes())
+    digest.update(np.asarray(lat, dtype='f8').tobytes())
+    return digest.hexdigest()[:16]
+
+
+def target_grid(grid, box=None):
+    """(lon, lat) of a grid file, within the box (lon_min, lon_max, lat_min, lat_max)."""
+    with Dataset(grid) as nc:
+        names = {v.lower(): v for v in nc.variables}
+        lon = nc.variables[names.get('lon', names.get('longitude'))][:]
+        lat = nc.variables[names.get('lat', names.get('latitude'))][:]
+    if box is None:
+        return np.asarray(lon), np.asarray(lat)
+    lon_index, lat_index, lon_box = virtual_dataset.box_indices(lon, lat, box)
+    return np.asarray(lon_box), np.asarray(lat)[lat_index]
+
+
+def intervals(source, target, periodic=False):
+    """For every target coordinate the lower source index and the weight of the upper one;
+    index -1 for targets outside the source coordinates."""
+    source = np.asarray(source, dtype='f8')
+    order = np.argsort(source, kind='stable') # descending latitudes
+    values = source[order]
+    target = np.asarray(target, dtype='f8')
+    if periodic: # wrap around: the first point again at +360
+        order = np.append(order, order[0])
+        values = np.append(values, values[0] + 360.)
+        target = values[0] + (target - values[0]) % 360.
+    lower = np.clip(np.searchsorted(values, target, side='right') - 1, 0, len(values) - 2)
+    weight = (target - values[lower]) / (values[lower + 1] - values[lower])
+    outside = (target < values[0]) | (target > values[-1])
+    return np.where(outside, -1, order[lower]), np.where(outside, -1, order[lower + 1]), weight
+
+
+def bilinear(src_lon, src_lat, dst_lon, dst_lat):
+    """Sparse matrix (target points x source points) of bilinear weights between two regular
+    lon/lat grids, rows of target points outside the source grid are empty."""
+    spacing = np.abs(np.diff(src_lon)).max() if len(src_lon) > 1 else 360.
+    periodic = abs(len(src_lon) * spacing - 360.) < 1e-6 * 360.
+    lon0, lon1, a = intervals(src_lon, dst_lon, periodic)
+    lat0, lat1, b = intervals(src_lat, dst_lat)
+    nx = len(src_lon)
+    # corners (lat, lon) of every target point: shape (target lat, target lon)
+    rows, cols, values = [], [], []
+    target = np.arange(len(dst_lat) * len(dst_lon)).reshape(len(dst_lat), len(dst_lon))
+    for j, wj in ((lat0, 1 - b), (lat1, b)):
+        for i, wi in ((lon0, 1 - a), (lon1, a)):
+            valid = (j[:, np.newaxis] >= 0) & (i[np.newaxis, :] >= 0)
+            w = wj[:, np.newaxis] * wi[np.newaxis, :]
+            valid &= w > 0
+            rows.append(target[valid])
+            cols.append((j[:, np.newaxis] * nx + i[np.newaxis, :])[valid])
+            values.append(w[valid])
+    # a target point is only valid if all four corners are in the source grid
+    inside = (lat0[:, np.newaxis] >= 0) & (lon0[np.newaxis, :] >= 0)
+    keep = np.isin(np.concatenate(rows), target[inside])
+    matrix = scipy.sparse.csr_matrix(
+        (np.concatenate(values)[keep], (np.concatenate(rows)[keep],
+                                        np.concatenate(cols)[keep])),
+        shape=(target.size, len(src_lat) * nx))
+    matrix.sum_duplicates() # corners on the grid points themselves
+    return matrix
+
+
+class Regridder:
+    """Cached bilinear weights from a source grid to the target points (lon, lat)."""
+
+    def __init__(self, matrix, lon, lat):
+        self.matrix = matrix
+        self.lon = lon
+        self.lat = lat
+        self.covered = np.asarray(matrix.sum(axis=1)).ravel() > 0.5 # rows with weights
+        self.corners = matrix.copy()
+        self.corners.data[:] = 1 # which source points a target point uses
+
+    def __call__(self, block, fill=None):
+        """Regrid a block (time, source lat, source lon) to (time, lat, lon)."""
+        n = block.shape[0]
+        x = block.reshape(n, -1).T # source points x time steps
+        missing = ~np.isfinite(x)
+        if fill is not None: # compared in the type of the data (e.g. 1e20 as float32)
+            missing |= x == np.asarray(fill, dtype=block.dtype)
+        x = x.astype('f8')
+        result = self.matrix @ np.where(missing, 0., x)
+        invalid = ~self.covered[:, np.newaxis] | (self.corners @ missing.astype('f8') > 0)
+        if fill is None:
+            fill = np.nan
+        result[invalid] = fill
+        return result.T.reshape(n, len(self.lat), len(self.lon)).astype(block.dtype)
+
+
+def weights(src_lon, src_lat, grid, box=None, cache_dir=cache_dir):
+    """Regridder from the source grid (lon, lat) to grid (file) within box, from the cache if
+    the same source and target grid were used before."""
+    lon, lat = target_grid(grid, box)
+    key = grid_hash(src_lon, src_lat) + '_' + grid_hash(lon, lat)
+    if key in _cache:
+        return _cache[key]
+    filename = os.path.join(cache_dir, key + '.npz')
+    if os.path.exists(filename):
+        with np.load(filename) as f:
+            matrix = scipy.sparse.csr_matrix((f['data'], f['indices'], f['indptr']),
+                                             shape=tuple(f['shape']))
+    else:
+        matrix = bilinear(src_lon, src_lat, lon, lat)
+        os.makedirs(cache_dir, exist_ok=True)
+        # temporary name in the same directory, other workers may write the same weights
+        tmp = filename[:-4] + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                 shape=np.array(matrix.shape))
+        os.replace(tmp, filename)
+    _cache[key] = Regridder(matrix, lon, lat)
+    return _cache[key]
+
+
+def matches_cdo(chain, sample, variable, regridder, box, level, level_value, workdir):
+    """Compare the variable regridded with regridder (after the box and level selection)
+    with cdo running the chain on a sample file; time selections are left out."""
+    reference = os.path.join(workdir, os.path.basename(sample)[:-3] + '_cdo.nc')
+    test = os.path.join(workdir, os.path.basename(sample)[:-3] + '_weights.nc')
+    try:
+        cdo_planner.run([op for op in chain if op[0] not in cdo_planner.time_selections],
+                        sample, reference)
+        dataset = virtual_dataset.VirtualDataset([sample], variable)
+        dataset.write(test, None, box, level, level_value=level_value, remap=regridder)
+        return cdo_planner.same_output(reference, test, variables=[variable])
+    finally:
+        for output in (reference, test):
+            if os.path.exists(output):
+                os.remove(output)
+
+
+if __name__ == '__main__':
+    # weights of a model grid (lon/lat of a model file) to grid.nc, e.g. to fill the cache
+    if len(sys.argv) < 3:
+        sys.exit('usage: python regrid_weights.py source.nc grid.nc [lon_min,lon_max,lat_min,'
+                 'lat_max]')
+    starttime = datetime.now() # start stopwatch
+    src_lon, src_lat = target_grid(sys.argv[1])
+    box = tuple(float(x) for x in sys.argv[3].split(',')) if len(sys.argv) > 3 else None
+    regridder = weights(src_lon, src_lat, sys.argv[2], box)
+    print(str(regridder.matrix.shape) + ' weights, ' + str(regridder.matrix.nnz) +
+          ' non-zero, ' + str(int(regridder.covered.sum())) + ' target points covered')
+    print(datetime.now() - starttime)
@@ -0,0 +1,80 @@
+# Purpose: Streaming seasonal climatology and anomalies of the tas maps, replacing
+#          cdo yseassub of the temporary _past.nc/_future.nc files with -yseasavg of the past
+#          file (computed twice, once per period)
+#          (1) the 1988-2017 seasonal mean (DJF, MAM, JJA, SON as cdo yseasavg) of every grid
+#              point is accumulated in one pass over the blocks of time steps, with float64
+#              running sums and counts of the valid (non-missing) values
+#          (2) the climatology is subtracted from the blocks of the past and the future period
+#              while they are written, so no temporary files are needed
+#          usage: from a script, climatology = SeasonalClimatology(units, calendar), add(...)
+#                 for the blocks of the past and write(..., transform=climatology.subtract)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import numpy as np # package for calculations
+import cftime # model calendars
+from calendar_conversion import seasons, season_of_month
+
+
+def valid_values(block, fill=None):
+    """Mask of the valid values of a block (finite and not the fill value)."""
+    valid = np.isfinite(block)
+    if fill is not None: # compared in the type of the data (e.g. 1e20 as float32)
+        valid &= block != np.asarray(fill, dtype=block.dtype)
+    return valid
+
+
+class SeasonalClimatology:
+    """Seasonal means per grid point, accumulated from blocks (time, ...) of a time axis."""
+
+    def __init__(self, units, calendar='standard'):
+        self.units = units
+        self.calendar = calendar
+        self.sums = None # (season, ...) float64
+        self.counts = None # (season, ...) valid values
+        self._mean = None
+
+    def season(self, values):
+        """Season index (0 = spring ... 3 = winter) of time values."""
+        dates = cftime.num2date(values, self.units, self.calendar)
+        return season_of_month(np.array([d.month for d in np.atleast_1d(dates)]))
+
+    def add(self, values, block, fill=None):
+        """Add a block of time steps (time values, data with time as first axis)."""
+        if self.sums is None:
+            self.sums = np.zeros((len(seasons),) + block.shape[1:])
+            self.counts = np.zeros((len(seasons),) + block.shape[1:], dtype='i8')
+        self._mean = None
+        season = self.season(values)
+        valid = valid_values(block, fill)
+        data = np.where(valid, block, 0.).astype('f8')
+        for s in range(len(seasons)):
+            days = season == s
+            if days.any():
+                self.sums[s] += data[days].sum(axis=0)
+                self.counts[s] += valid[days].sum(axis=0)
+
+    def mean(self):
+        """Seasonal means (season, ...), NaN where a season has no valid value."""
+        if self._mean is None: # computed once for all blocks to subtract
+            self._mean = np.where(self.counts > 0, self.sums / np.maximum(self.counts, 1),
+                                  np.nan)
+        return self._mean
+
+    def subtract(self, values, block, fill=None):
+        """Anomalies of a block relative to the climatology (as cdo yseassub), in the type of
+        the block; missing values and grid points without climatology get the fill value."""
+        if self.sums is None:
+            raise ValueError('climatology is empty, add the blocks of the reference period')
+        mean = self.mean()
+        anomalies = block.astype('f8') - mean[self.season(values)]
+        missing = ~valid_values(block, fill) | ~np.isfinite(anomalies)
+        anomalies[missing] = np.nan if fill is None else fill
+        return anomalies.astype(block.dtype)
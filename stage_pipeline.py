@@ -0,0 +1,129 @@
+# Purpose: Pipelined execution of the preprocessing stages of many members, so the I/O heavy
+#          stages (mergetime, subsetting, NCO) of the next members overlap with the CPU heavy
+#          stages (cost733class) of the previous ones
+#          (1) a job (e.g. one model realisation) is a list of stages, a stage is a tuple
+#              (name, commands, output) with commands as argv lists (no shell, no string
+#              concatenation) run one after the other; a stage whose output already exists
+#              is skipped (as force = False of the cdo bindings), so the commands write to
+#              partial(output) (output + '.tmp') which is renamed to output only after all
+#              commands of the stage succeeded, i.e. a killed or failed stage never leaves a
+#              file that looks done
+#          (2) all jobs run as asyncio tasks, every job runs its stages in order and every
+#              stage name has its own concurrency limit (semaphore), e.g. two mergetime and
+#              four cost733class processes at the same time
+#          (3) every job has its own working directory (removed after success), progress and
+#              failures are collected centrally as in parallel_driver.py
+#          usage: from a script, run(jobs, limits) with jobs = {(model, realisation): function
+#                 returning the stages for a working directory, or None to skip the job}
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import asyncio
+import os
+import shutil
+import traceback
+from datetime import datetime # package for stopping time
+from parallel_driver import report, workdir_of
+
+default_limit = 2 # parallel processes of a stage without its own limit
+
+
+async def run_command(argv, cwd=None):
+    """Run one command (argv list) as subprocess and raise if it fails."""
+    process = await asyncio.create_subprocess_exec(*argv, cwd=cwd)
+    status = await process.wait()
+    if status != 0:
+        raise RuntimeError('exit status ' + str(status) + ': ' + ' '.join(argv))
+
+
+def partial(output):
+    """File the commands of a stage write, renamed to output when the stage succeeded."""
+    return output + '.tmp'
+
+
+async def run_stage(stage, cwd, semaphore):
+    """Run the commands of a stage within its concurrency limit, returns False if skipped."""
+    name, commands, output = stage
+    if output is not None and os.path.exists(output):
+        return False
+    async with semaphore:
+        if output is not None and os.path.exists(partial(output)): # from a killed run
+            os.remove(partial(output))
+        for argv in commands:
+            await run_command(argv, cwd)
+    if output is not None:
+        os.replace(partial(output), output)
+    return True
+
+
+def semaphore(locks, limits, name):
+    """Semaphore of a stage name, created on first use within the running event loop."""
+    if name not in locks:
+        locks[name] = asyncio.Semaphore(limits.get(name, default_limit))
+    return locks[name]
+
+
+async def run_stages_async(stages, cwd=None, limits=None, locks=None):
+    """Run the stages of one job in order, returns the number of stages actually run."""
+    locks = {} if locks is None else locks
+    ran = 0
+    for stage in stages:
+        ran += await run_stage(stage, cwd, semaphore(locks, limits or {}, stage[0]))
+    return ran
+
+
+def run_stages(stages, cwd=None):
+    """Run the stages of a single job in order (e.g. within a parallel_driver.py worker)."""
+    return asyncio.run(run_stages_async(stages, cwd))
+
+
+async def _run_job(job, build, workdir, limits, locks):
+    starttime = datetime.now() # start stopwatch
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        stages = build(workdir)
+        if stages is None:
+            return job, 'skipped', None, datetime.now() - starttime
+        await run_stages_async(stages, workdir, limits, locks)
+    except Exception:
+        return job, 'failed', traceback.format_exc(), datetime.now() - starttime
+    return job, 'done', None, datetime.now() - starttime
+
+
+async def run_async(jobs, limits, workroot, keep):
+    locks = {} # shared by all jobs, i.e. the limits hold over all members
+    tasks = [asyncio.ensure_future(_run_job(job, build, workdir_of(workroot, job), limits,
+                                            locks))
+             for job, build in jobs.items()]
+    results = {}
+    for task in asyncio.as_completed(tasks):
+        job, status, message, duration = await task
+        results[job] = (status, message, duration)
+        if status != 'failed' and not keep:
+            shutil.rmtree(workdir_of(workroot, job), ignore_errors=True)
+        print('[' + str(len(results)) + '/' + str(len(jobs)) + '] ' + ' '.join(job) + ': ' +
+              status + ' after ' + str(duration))
+    return results
+
+
+def run(jobs, limits=None, workroot='work', keep=False):
+    """Run all jobs {job key: build(workdir) -> stages or None} with per-stage limits.
+
+    Returns a dict {job: (status, message, duration)} with status 'done', 'skipped' or
+    'failed' (message = traceback); failures are also written to <workroot>/failures.txt.
+    """
+    workroot = os.path.abspath(workroot)
+    os.makedirs(workroot, exist_ok=True)
+    starttime = datetime.now() # start stopwatch
+    results = asyncio.run(run_async(jobs, limits or {}, workroot, keep))
+
+    report(results, list(jobs), workroot)
+    print(datetime.now() - starttime)
+    return results
@@ -0,0 +1,171 @@
+# Purpose: Seasonal transition matrices of the circulation types and Markov chain surrogate
+#          sequences with the same transition structure, as cheap null model for persistence
+#          (1) count all (type today -> type tomorrow) pairs of consecutive days within a
+#              season for every period, member and season with one bincount; pairs with a NaN
+#              leap day, across a date gap or a season edge are left out
+#          (2) transition probabilities are the row-normalised counts; a type without any
+#              transition (e.g. only seen on the last day of a season) gets the seasonal
+#              frequency of the types as its row
+#          (3) surrogates: all (member, season) chains are simulated at once, day by day, by
+#              inverse transform sampling of the cumulative transition rows, one sequence per
+#              year with the mean number of days of the season; their run-length histograms
+#              have the layout of persistence.py, so persistence_fit.fit() applies directly
+#          usage: python transitions.py cost_..._Z500.dat output.npz [n_surrogates]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+import frequency
+import persistence_fit
+from calendar_conversion import seasons, season_of_month
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import day_numbers, periods
+
+seed = 2018 # same seed as the leap day insertion
+max_length = 20 # run-length bins of the surrogate histograms, the last one is an overflow bin
+
+
+def transition_counts(types, dates, n_types=None, calendar='gregorian',
+                      years=(periods['past'], periods['future'])):
+    """Counts (period, member, season, from type, to type) of consecutive day pairs."""
+    types = np.asarray(types)
+    if types.ndim == 1:
+        types = types[:, None]
+    if n_types is None:
+        n_types = int(types[types != missing].max(initial=0))
+    n_members = types.shape[1]
+    n_seasons = len(seasons)
+
+    # a pair (day i, day i+1) is used if both days are in the same period and season
+    period = frequency.period_numbers(dates, years)
+    season = season_of_month(dates[:, 1])
+    pair = ((np.diff(day_numbers(dates, calendar)) == 1) & (period[1:] == period[:-1]) &
+            (period[:-1] >= 0) & (season[1:] == season[:-1]))
+    group = np.where(pair, period[:-1] * n_seasons + season[:-1], 0)
+
+    today = types[:-1].astype(np.int64)
+    tomorrow = types[1:].astype(np.int64)
+    valid = (pair[:, None] & (today >= 1) & (today <= n_types) &
+             (tomorrow >= 1) & (tomorrow <= n_types))
+    member = np.arange(n_members)[None, :]
+    index = (((group[:, None] * n_members + member) * n_types + today - 1) * n_types +
+             tomorrow - 1)
+    n_groups = len(years) * n_seasons
+    counts = np.bincount(index[valid], minlength=n_groups * n_members * n_types * n_types)
+    counts = counts.reshape(len(years), n_seasons, n_members, n_types, n_types)
+    return counts.transpose(0, 2, 1, 3, 4)
+
+
+def transition_matrices(counts):
+    """Transition probabilities (..., from, to) and the type frequencies (..., type).
+
+    Rows without transitions are replaced by the type frequencies of the same cell.
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1, keepdims=True)
+    frequencies = total[..., 0] + counts.sum(axis=-2) # every type as from or to type
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequencies = frequencies / frequencies.sum(axis=-1, keepdims=True)
+        matrices = np.where(total > 0, counts / total, frequencies[..., None, :])
+    return matrices, frequencies
+
+
+def surrogates(matrices, initial, n_days, n_sequences, rng):
+    """Markov chain sequences (..., n_sequences, n_days) of types 1..n_types.
+
+    matrices -> transition probabilities (..., from, to)
+    initial  -> distribution of the first day (..., type)
+    All chains of all cells are advanced together, one day per step.
+    """
+    matrices = np.asarray(matrices, dtype=float)
+    batch = matrices.shape[:-2]
+    n_types = matrices.shape[-1]
+    cdf = np.cumsum(matrices, axis=-1).reshape(-1, n_types, n_types)
+    cdf[..., -1] = 1. # guard against rounding
+    first = np.cumsum(np.asarray(initial, dtype=float), axis=-1).reshape(-1, n_types)
+    first[..., -1] = 1.
+    n_cells = len(cdf)
+
+    out = np.empty((n_cells, n_sequences, n_days), dtype=np.uint8)
+    u = rng.random((n_cells, n_sequences))
+    state = (u[..., None] > first[:, None, :]).sum(axis=-1)
+    out[..., 0] = state
+    cell = np.arange(n_cells)[:, None]
+    for day in range(1, n_days):
+        rows = cdf[cell, state] # cumulative row of the current type, (cells, sequences, to)
+        u = rng.random((n_cells, n_sequences))
+        state = (u[..., None] > rows).sum(axis=-1)
+        out[..., day] = state
+    return (out + 1).reshape(batch + (n_sequences, n_days))
+
+
+def sequence_histogram(sequences, n_types, max_length=max_length):
+    """Run-length histogram (..., type, length) of sequences (..., n_days), overflow bin last."""
+    shape, n_days = sequences.shape[:-1], sequences.shape[-1]
+    flat = sequences.reshape(-1, n_days)
+    n_cells = len(flat)
+    start = np.ones(flat.shape, dtype=bool)
+    start[:, 1:] = flat[:, 1:] != flat[:, :-1]
+    start = np.flatnonzero(start.ravel())
+    length = np.diff(np.r_[start, flat.size])
+    cell = start // n_days
+    run_type = flat.ravel()[start].astype(np.int64)
+    index = ((cell * n_types + run_type - 1) * max_length +
+             np.minimum(length, max_length) - 1)
+    counts = np.bincount(index, minlength=n_cells * n_types * max_length)
+    return counts.reshape(shape + (n_types, max_length))
+
+
+def season_days(dates, years=periods['past']):
+    """Mean number of days per year of every season (rounded) within a year range."""
+    inside = (dates[:, 0] >= years[0]) & (dates[:, 0] <= years[1])
+    days = np.bincount(season_of_month(dates[inside, 1]), minlength=len(seasons))
+    return np.rint(days / (years[1] - years[0] + 1)).astype(int)
+
+
+def surrogate_histograms(matrices, initial, days, n_years, n_surrogates, max_length=max_length,
+                         seed=seed):
+    """Run-length histograms (surrogate, member, type, season, length) of Markov surrogates.
+
+    matrices -> (member, season, from, to), initial -> (member, season, type)
+    days     -> number of days of every season, n_years -> sequences per season
+    """
+    rng = np.random.default_rng(seed)
+    n_members, n_seasons, n_types = matrices.shape[:3]
+    out = np.zeros((n_surrogates, n_members, n_types, n_seasons, max_length), dtype=np.int64)
+    for s in range(n_seasons): # seasons differ in length
+        seq = surrogates(matrices[:, s], initial[:, s], days[s], n_surrogates * n_years, rng)
+        seq = seq.reshape(n_members, n_surrogates, n_years, days[s])
+        hist = sequence_histogram(seq, n_types, max_length).sum(axis=2)
+        out[:, :, :, s] = hist.transpose(1, 0, 2, 3)
+    return out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python transitions.py cost_matrix.dat output.npz [n_surrogates]')
+    starttime = datetime.now() # start stopwatch
+    dates, types, names = cost_parser.read(sys.argv[1])
+    counts = transition_counts(types, dates)
+    matrices, initial = transition_matrices(counts)
+    output = {'counts': counts, 'matrices': matrices}
+    if len(sys.argv) > 3: # persistence measure of surrogates for both periods
+        n_surrogates = int(sys.argv[3])
+        for p, name in enumerate(('past', 'future')):
+            hist = surrogate_histograms(matrices[p], initial[p],
+                                        season_days(dates, periods[name]),
+                                        periods[name][1] - periods[name][0] + 1, n_surrogates)
+            output[name + '_surrogate_slope'] = persistence_fit.fit(hist, overflow=True)['slope']
+    np.savez(sys.argv[2], members=names, seasons=seasons, **output)
+    print(str(counts.shape) + ' transition counts written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
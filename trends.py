@@ -0,0 +1,156 @@
+# Purpose: Vectorized trend engine for the annual frequency of circulation types, replacing
+#          one lm() per member, season and type in FigsS3-S7_time_series_and_trends.R
+#          (1) annual counts (member, year, season, type) from frequency.py
+#          (2) ordinary least squares for all cells at once in closed form: slope, intercept,
+#              standard error of the slope and two-sided p-value (t-test, n-2 degrees of
+#              freedom) as in summary(lm(y ~ year))
+#          (3) Mann-Kendall test (with tie correction) and Sen's slope (median of all pairwise
+#              slopes) as robust alternative, computed over all year pairs in chunks of cells
+#          (4) both for the past period 1988-2017 and for the whole record 1960-2099
+#          usage: python trends.py cost_..._Z500.dat output.npz [output.txt]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+from scipy import special # t and normal distribution for the p-values
+import cost_parser # chunked parser for the text files
+import frequency
+from calendar_conversion import seasons
+from date_index import periods
+
+# year ranges of the trends: past period and whole record of the model runs
+windows = {'past': periods['past'], 'full': (1960, 2099)}
+max_pairs = 1 << 24 # number of (cell, year pair) values held in memory by Sen's slope
+
+
+def ols(y, x):
+    """Least squares line through y (..., n) over x (n) for all cells at once.
+
+    Returns a dict of arrays (...): slope, intercept, stderr (of the slope), pvalue
+    (two-sided, H0: slope = 0) and n.
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    xm = x - x.mean()
+    sxx = xm @ xm
+    ym = y.mean(axis=-1)
+    slope = (y @ xm) / sxx
+    intercept = ym - slope * x.mean()
+    residual = y - (ym[..., None] + slope[..., None] * xm)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stderr = np.sqrt((residual * residual).sum(axis=-1) / (n - 2) / sxx)
+        t = slope / stderr
+        pvalue = 2 * special.stdtr(n - 2, -np.abs(t))
+    pvalue = np.where(stderr == 0, np.where(slope == 0, 1., 0.), pvalue) # perfect fit
+    if n < 3:
+        stderr = np.full(slope.shape, np.nan)
+        pvalue = np.full(slope.shape, np.nan)
+    return {'slope': slope, 'intercept': intercept, 'stderr': stderr, 'pvalue': pvalue,
+            'n': np.full(slope.shape, n)}
+
+
+def tie_sums(y):
+    """Sum of t(t-1)(2t+5) over the groups of t equal values of every row of y (cells, n)."""
+    cells, n = y.shape
+    s = np.sort(y, axis=1)
+    start = np.ones(s.shape, dtype=bool)
+    start[:, 1:] = s[:, 1:] != s[:, :-1]
+    start = np.flatnonzero(start.ravel())
+    t = np.diff(np.r_[start, cells * n]).astype(float)
+    return np.bincount(start // n, weights=t * (t - 1) * (2 * t + 5), minlength=cells)
+
+
+def mann_kendall(y, x):
+    """Mann-Kendall test and Sen's slope of y (..., n) over x (n) for all cells at once.
+
+    Returns a dict of arrays (...): sen_slope, sen_intercept (median of y - slope * x),
+    s (Kendall statistic), z and pvalue (two-sided, normal approximation with tie
+    correction and continuity correction).
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    shape, n = y.shape[:-1], y.shape[-1]
+    y = y.reshape(-1, n)
+    i, j = np.triu_indices(n, k=1) # all year pairs i < j
+    dx = x[j] - x[i]
+    cells = len(y)
+    sen = np.empty(cells)
+    s = np.empty(cells)
+    step = max(1, max_pairs // max(len(i), 1))
+    for first in range(0, cells, step): # bounded memory: cells x pairs per chunk
+        dy = y[first:first + step, j] - y[first:first + step, i]
+        s[first:first + step] = np.sign(dy).sum(axis=1)
+        sen[first:first + step] = np.median(dy / dx, axis=1) if len(i) else np.nan
+    intercept = np.median(y - sen[:, None] * x, axis=1)
+
+    var = (n * (n - 1) * (2 * n + 5) - tie_sums(y)) / 18.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(var > 0, (s - np.sign(s)) / np.sqrt(var), 0.)
+    pvalue = special.erfc(np.abs(z) / np.sqrt(2))
+    return {'sen_slope': sen.reshape(shape), 'sen_intercept': intercept.reshape(shape),
+            's': s.reshape(shape), 'z': z.reshape(shape), 'pvalue': pvalue.reshape(shape)}
+
+
+def trends(counts, years, window=windows['past'], robust=True):
+    """OLS (and Mann-Kendall/Sen) trends of annual counts (member, year, season, type).
+
+    Only the years within window (first, last) are used. Returns a dict of arrays
+    (member, season, type): slope, intercept, stderr, pvalue, n and with robust=True
+    sen_slope, sen_intercept, mk_s, mk_z, mk_pvalue.
+    """
+    years = np.asarray(years)
+    used = (years >= window[0]) & (years <= window[1])
+    y = np.moveaxis(np.asarray(counts)[:, used], 1, -1) # (member, season, type, year)
+    result = ols(y, years[used])
+    if robust:
+        mk = mann_kendall(y, years[used])
+        result.update({'sen_slope': mk['sen_slope'], 'sen_intercept': mk['sen_intercept'],
+                       'mk_s': mk['s'], 'mk_z': mk['z'], 'mk_pvalue': mk['pvalue']})
+    return result
+
+
+def trends_file(filename, windows=windows, robust=True, n_types=None):
+    """Trends of a cost733class matrix file for every window, {window name: trends()}."""
+    dates, types, names = cost_parser.read(filename)
+    counts, years = frequency.annual_counts(types, dates, n_types)
+    return {name: trends(counts, years, window, robust)
+            for name, window in windows.items()}, names
+
+
+def write_table(results, filename, members=None):
+    """Write the trends of all windows as a long table for R (read.table)."""
+    with open(filename, 'w') as f:
+        f.write('window member season type slope stderr pvalue sen_slope mk_pvalue\n')
+        for window, result in results.items():
+            shape = result['slope'].shape
+            names = members or ['e%02d' % (i + 1) for i in range(shape[0])]
+            for m, s, t in np.ndindex(*shape):
+                f.write('%s %s %s %d %.6g %.6g %.6g %.6g %.6g\n' % (
+                    window, names[m], seasons[s], t + 1, result['slope'][m, s, t],
+                    result['stderr'][m, s, t], result['pvalue'][m, s, t],
+                    result['sen_slope'][m, s, t], result['mk_pvalue'][m, s, t]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit('usage: python trends.py cost_matrix.dat output.npz [output.txt]')
+    starttime = datetime.now() # start stopwatch
+    results, names = trends_file(sys.argv[1])
+    arrays = {window + '_' + key: value for window, result in results.items()
+              for key, value in result.items()}
+    np.savez(sys.argv[2], members=names, seasons=seasons,
+             windows=np.array(list(windows.values())), **arrays)
+    if len(sys.argv) > 3:
+        write_table(results, sys.argv[3], names)
+    print(str(results['past']['slope'].shape) + ' trends written to ' + sys.argv[2])
+    print(datetime.now() - starttime)
@@ -0,0 +1,288 @@
+# Purpose: Lazy, time-concatenated view over the original daily CMIP5 chunk files of one
+#          variable (e.g. all zg_day_* files of the historical and rcp85 runs of a realisation),
+#          so no merged global copies are needed (cdo mergetime of the chunks and of
+#          historical + rcp85)
+#          (1) the time axis of every file is read once (converted to the units of the first
+#              file) and the files are sorted by time; time steps already covered by a
+#              previous file are skipped as in cdo mergetime
+#          (2) a selection of years, a lon/lat box (as cdo sellonlatbox, longitudes wrapped)
+#              and a level is pushed down to the files: only the files overlapping the years
+#              are opened and only the hyperslab of the box is read, in chunks of time steps
+#          (3) the selection can be written to a small regional file (netCDF) or iterated in
+#              blocks (e.g. by fused_preprocessing.py)
+#          usage: python virtual_dataset.py output.nc variable 1988/2017 -20,40,30,80 [level]
+#                        -- source.nc [source.nc ...]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import contextlib
+import glob
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cftime # model calendars
+from netCDF4 import Dataset
+
+chunk = 3650 # time steps read at once
+
+
+def source_files(directory, variable):
+    """Daily chunk files of a variable in a directory (./historical/day/zg/MODEL/r1i1p1/)."""
+    return sorted(glob.glob(os.path.join(directory, variable + '_day_*')))
+
+
+def find_coordinate(nc, var, kind):
+    """Name of the 'time', 'lat' or 'lon' dimension of a variable."""
+    standard = {'time': 'time', 'lat': 'latitude', 'lon': 'longitude'}[kind]
+    for dim in var.dimensions:
+        coordinate = nc.variables.get(dim)
+        if dim.startswith(kind) or (coordinate is not None and
+                                    getattr(coordinate, 'standard_name', '') == standard):
+            return dim
+    raise ValueError('no ' + kind + ' dimension in ' + var.name + str(var.dimensions))
+
+
+def runs(index):
+    """Split indices into runs of consecutive ascending indices, as a list of slices."""
+    index = np.asarray(index)
+    if len(index) == 0:
+        return []
+    breaks = np.nonzero(np.diff(index) != 1)[0] + 1
+    return [slice(int(r[0]), int(r[-1]) + 1) for r in np.split(index, breaks)]
+
+
+def box_indices(lon, lat, region):
+    """Longitude and latitude indices within the box (lon_min, lon_max, lat_min, lat_max) and
+    the longitudes of the box, wrapped to lon_min ... lon_min + 360 as in cdo."""
+    lon_min, lon_max, lat_min, lat_max = region
+    offset = (np.asarray(lon) - lon_min) % 360.
+    lon_index = np.nonzero(offset <= lon_max - lon_min)[0]
+    lon_index = lon_index[np.argsort(offset[lon_index], kind='stable')]
+    lat_index = np.nonzero((np.asarray(lat) >= lat_min) & (np.asarray(lat) <= lat_max))[0]
+    return lon_index, lat_index, lon_min + offset[lon_index]
+
+
+def copy_attributes(source, target, skip=()):
+    target.setncatts({k: source.getncattr(k) for k in source.ncattrs()
+                      if k not in ('_FillValue', 'bounds') + tuple(skip)})
+
+
+class VirtualDataset:
+    """One variable of several files, concatenated in time without reading the data."""
+
+    def __init__(self, files, variable, io=None):
+        if not files:
+            raise ValueError('no files for ' + variable)
+        self.variable = variable
+        # context around every read and write of data, e.g. a semaphore limiting the number of
+        # processes reading from the shared file system at the same time
+        self.io = io if io is not None else contextlib.nullcontext()
+        parts = []
+        for filename in files:
+            with Dataset(filename) as nc:
+                var = nc.variables[variable]
+                names = [find_coordinate(nc, var, kind) for kind in ('time', 'lat', 'lon')]
+                time = nc.variables[names[0]]
+                if not parts: # grid, units and calendar of the first file
+                    self.time_name, self.lat_name, self.lon_name = names
+                    self.units = time.units
+                    self.calendar = getattr(time, 'calendar', 'standard')
+                    self.dimensions = var.dimensions
+                    self.lat = nc.variables[self.lat_name][:]
+                    self.lon = nc.variables[self.lon_name][:]
+                    levels = [d for d in var.dimensions if d not in names]
+                    self.level_name = levels[0] if levels else None
+                    self.levels = nc.variables[self.level_name][:] if levels else None
+                    self.fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() \
+                                else None
+                values = np.asarray(time[:], dtype='f8')
+                if time.units != self.units:
+                    values = cftime.date2num(cftime.num2date(values, time.units, self.calendar),
+                                             self.units, self.calendar)
+                if var.shape[1:] != self.shape_of(nc):
+                    raise ValueError(filename + ': grid differs from ' + files[0])
+            parts.append((values[0] if len(values) else np.inf, filename, values))
+
+        # files in time order, time steps already covered by a previous file are skipped
+        self.files, self.steps, times = [], [], []
+        last = -np.inf
+        for _, filename, values in sorted(parts):
+            steps = np.nonzero(values > last)[0]
+            if len(steps) == 0:
+                continue
+            self.files.append(filename)
+            self.steps.append(steps)
+            times.append(values[steps])
+            last = values[steps[-1]]
+        self.time = np.concatenate(times)
+        self.file_of = np.repeat(np.arange(len(self.files)), [len(s) for s in self.steps])
+        self.dates = cftime.num2date(self.time, self.units, self.calendar)
+        self.year = np.array([d.year for d in self.dates])
+
+    def shape_of(self, nc):
+        """Shape of the non-time dimensions of the variable in a file of the same grid."""
+        return tuple(len(nc.dimensions[d]) for d in self.dimensions[1:])
+
+    def __len__(self):
+        return len(self.time)
+
+    def time_steps(self, years=None):
+        """Positions on the virtual time axis within the years (first, last)."""
+        if years is None:
+            return np.arange(len(self.time))
+        return np.nonzero((self.year >= years[0]) & (self.year <= years[1]))[0]
+
+    def level_index(self, level):
+        if level is None:
+            if self.level_name is not None:
+                raise ValueError(self.variable + ' has levels ' + self.level_name +
+                                 ', select one')
+            return None
+        if self.level_name is None:
+            raise ValueError(self.variable + ' has no levels')
+        index = np.nonzero(np.isclose(self.levels, level))[0]
+        if len(index) == 0:
+            raise ValueError('level ' + str(level) + ' not in ' + str(self.levels))
+        return int(index[0])
+
+    def coordinates(self, region=None, invert=False):
+        """(lon index, lat index, lon, lat) of a box, latitudes reversed with invert."""
+        if region is None:
+            lon_index, lat_index = np.arange(len(self.lon)), np.arange(len(self.lat))
+            lon = self.lon
+        else:
+            lon_index, lat_index, lon = box_indices(self.lon, self.lat, region)
+        if invert:
+            lat_index = lat_index[::-1]
+        return lon_index, lat_index, lon, self.lat[lat_index]
+
+    def blocks(self, years=None, region=None, level=None, invert=False, chunk=chunk):
+        """Iterate over (time, data) of the selection, data as (time, lat, lon).
+
+        Only the files overlapping the years are opened and only the hyperslab of the box
+        and level is read; every block lies within one file and has at most chunk steps.
+        """
+        level_i = self.level_index(level)
+        lon_index, lat_index, _, _ = self.coordinates(region, invert)
+        lat_runs = runs(np.sort(lat_index))
+        lon_runs = runs(lon_index) # more than one if the box wraps around the grid edge
+        flip = len(lat_index) > 1 and lat_index[0] > lat_index[-1]
+        positions = self.time_steps(years)
+        for i in np.unique(self.file_of[positions]):
+            selected = positions[self.file_of[positions] == i]
+            steps = self.steps[i][selected - np.searchsorted(self.file_of, i)]
+            with Dataset(self.files[i]) as nc:
+                var = nc.variables[self.variable]
+                var.set_auto_maskandscale(False) # raw values as in the source
+                for start in range(0, len(steps), chunk):
+                    block = steps[start:start + chunk]
+                    with self.io:
+                        data = self._read(var, block, level_i, lat_runs, lon_runs)
+                    if flip:
+                        data = data[:, ::-1, :]
+                    yield self.time[selected[start:start + chunk]], data
+
+    @staticmethod
+    def _read(var, block, level_i, lat_runs, lon_runs):
+        """Hyperslab of several runs of time steps, latitudes or longitudes."""
+        level = (level_i,) if level_i is not None else ()
+        return np.concatenate(
+            [np.concatenate(
+                [np.concatenate([var[(time_run,) + level + (lat_run, lon_run)]
+                                 for lon_run in lon_runs], axis=-1)
+                 for lat_run in lat_runs], axis=-2)
+             for time_run in runs(block)], axis=0)
+
+    def read(self, years=None, region=None, level=None, invert=False):
+        """(time, data) of the whole selection in memory."""
+        blocks = list(self.blocks(years, region, level, invert))
+        if not blocks:
+            return self.time[:0], None
+        return (np.concatenate([b[0] for b in blocks]),
+                np.concatenate([b[1] for b in blocks], axis=0))
+
+    def write(self, output, years=None, region=None, level=None, invert=False,
+              time_units=None, level_value=None, format='NETCDF4', remap=None, transform=None):
+        """Write the selection to a file, returns the number of time steps.
+
+        The level dimension is kept with length 1 (value level_value, e.g. 0 as cdo setlevel,0,
+        or the selected level); time_units re-encodes the time axis (e.g. hours since ...);
+        remap regrids every block to the points (remap.lon, remap.lat), see regrid_weights.py;
+        transform(time values, block, fill) is applied to every block after remap (e.g.
+        SeasonalClimatology.subtract of seasonal_anomalies.py).
+        """
+        lon_index, lat_index, lon, lat = self.coordinates(region, invert)
+        if remap is not None:
+            lon, lat = remap.lon, remap.lat
+        level_i = self.level_index(level)
+        with Dataset(self.files[0]) as nc, Dataset(output, 'w', format=format) as out:
+            var = nc.variables[self.variable]
+            copy_attributes(nc, out)
+            out.history = datetime.now().strftime('%c') + ': virtual_dataset.py ' + \
+                          self.variable + ' ' + str(years) + ' ' + str(region) + \
+                          ('\n' + nc.history if 'history' in nc.ncattrs() else '')
+            out.createDimension(self.time_name, None)
+            time = out.createVariable(self.time_name, 'f8', (self.time_name,))
+            copy_attributes(nc.variables[self.time_name], time, skip=('units',))
+            time.units = time_units or self.units
+            dims = (self.time_name,)
+            if level_i is not None:
+                out.createDimension(self.level_name, 1)
+                levels = out.createVariable(self.level_name, nc.variables[self.level_name].dtype,
+                                            (self.level_name,))
+                copy_attributes(nc.variables[self.level_name], levels)
+                levels[:] = self.levels[level_i] if level_value is None else level_value
+                dims += (self.level_name,)
+            for name, values in ((self.lat_name, lat), (self.lon_name, lon)):
+                out.createDimension(name, len(values))
+                coordinate = out.createVariable(name, nc.variables[name].dtype, (name,))
+                copy_attributes(nc.variables[name], coordinate)
+                coordinate[:] = values
+            fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+            data = out.createVariable(self.variable, var.dtype, dims + (self.lat_name,
+                                                                        self.lon_name),
+                                      fill_value=fill)
+            copy_attributes(var, data)
+            data.set_auto_maskandscale(False)
+
+            n = 0
+            for values, block in self.blocks(years, region, level, invert):
+                if time_units is not None:
+                    values = cftime.date2num(cftime.num2date(values, self.units, self.calendar),
+                                             time_units, self.calendar)
+                if remap is not None:
+                    block = remap(block, fill)
+                if transform is not None:
+                    block = transform(values, block, fill)
+                with self.io:
+                    data[n:n + len(values)] = block if level_i is None else \
+                                              block[:, np.newaxis]
+                    time[n:n + len(values)] = values
+                n += len(values)
+        return n
+
+
+if __name__ == '__main__':
+    if '--' not in sys.argv or sys.argv.index('--') < 5:
+        sys.exit('usage: python virtual_dataset.py output.nc variable first/last '
+                 'lon_min,lon_max,lat_min,lat_max [level] -- source.nc [source.nc ...]')
+    starttime = datetime.now() # start stopwatch
+    split = sys.argv.index('--')
+    output, variable = sys.argv[1], sys.argv[2]
+    years = tuple(int(y) for y in sys.argv[3].split('/'))
+    region = tuple(float(x) for x in sys.argv[4].split(','))
+    level = float(sys.argv[5]) if split > 5 else None
+    dataset = VirtualDataset(sys.argv[split + 1:], variable)
+    n = dataset.write(output + '.tmp', years, region, level)
+    os.replace(output + '.tmp', output)
+    print(output + ': ' + str(n) + ' of ' + str(len(dataset)) + ' time steps from ' +
+          str(len(dataset.files)) + ' files')
+    print(datetime.now() - starttime)
@@ -0,0 +1,316 @@
+# Purpose: Work queue on a shared file system (e.g. /net/...), so the preprocessing of
+#          merging_cmip5.py, preprocessing_cmip5_maps_data.py and preprocessing_cesm.py can run
+#          on any number of nodes at the same time
+#          (1) the queue is a directory with one JSON file per job in pending/, claimed/, done/
+#              and failed/; a job calls <module>.process_member(*args, workdir=...), i.e. the
+#              (model, realisation) or (file, variable) jobs of the job_list of the scripts
+#          (2) a worker claims a job by renaming its file from pending/ to claimed/ (atomic, so
+#              exactly one worker gets it) under a name with its owner token
+#              (claimed/<job>@<host>.<pid>.json) and holds a lease on it: a heartbeat thread
+#              touches that file regularly while the job runs; a worker whose claimed file is
+#              gone has lost the lease and neither writes done/ nor removes any job file
+#          (3) every worker returns claimed jobs whose file was not touched for longer than the
+#              lease (dead worker or node) to pending/; after max_attempts expired leases the
+#              job is moved to failed/; the time of the file server is used for the lease, not
+#              the clocks of the nodes
+#          (4) every job runs in its own (node local) working directory under workroot, which
+#              is removed when the job is done and kept for inspection when it failed
+#          usage: python work_queue.py submit QUEUE merging_cmip5   (all jobs of the script)
+#                 python work_queue.py work QUEUE [n_workers]       (on every node)
+#                 python work_queue.py status QUEUE
+#                 python work_queue.py demo [n_workers]             (local test in a temp dir)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime # package for stopping time
+
+states = ('pending', 'claimed', 'done', 'failed')
+lease = 600.        # seconds without heartbeat after which a claimed job is taken back
+heartbeat = 60.     # seconds between two touches of a claimed job file
+poll = 30.          # seconds to wait when no job is pending but others are still running
+max_attempts = 3    # expired leases before a job is moved to failed/
+workroot = os.path.join(tempfile.gettempdir(), 'work_queue') # node local working directories
+
+
+def job_id(module, args):
+    return module + '__' + '_'.join(str(a) for a in args)
+
+
+def owner_token():
+    """Owner of the claims of this process, part of the claimed file names."""
+    return socket.gethostname() + '.' + str(os.getpid())
+
+
+def claimed_name(name, token):
+    """File name in claimed/ of a job file name and an owner token."""
+    return name[:-5] + '@' + token + '.json'
+
+
+def job_name(claimed):
+    """Job file name (as in pending/, done/, failed/) of a file name in claimed/."""
+    return claimed[:-5].rsplit('@', 1)[0] + '.json'
+
+
+def write_json(filename, data):
+    """Write a JSON file atomically (temporary file in the same directory + rename)."""
+    tmp = filename + '.' + socket.gethostname() + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, filename)
+
+
+def read_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def create(queue):
+    for state in states:
+        os.makedirs(os.path.join(queue, state), exist_ok=True)
+
+
+def job_files(queue, state):
+    """Names of the job files in one state directory (without temporary files)."""
+    try:
+        return sorted(n for n in os.listdir(os.path.join(queue, state)) if n.endswith('.json'))
+    except FileNotFoundError:
+        return []
+
+
+def submit(queue, module, job_list):
+    """Put jobs (lists of arguments of module.process_member) into the queue.
+
+    Jobs which are already in the queue (in any state) are not submitted again.
+    """
+    create(queue)
+    known = set()
+    for state in states:
+        known.update(job_name(n) if state == 'claimed' else n for n in job_files(queue, state))
+    n = 0
+    for args in job_list:
+        name = job_id(module, args) + '.json'
+        if name in known:
+            continue
+        write_json(os.path.join(queue, 'pending', name),
+                   {'module': module, 'args': list(args), 'attempts': 0})
+        n += 1
+    return n
+
+
+def server_time(queue):
+    """Current time of the file server (mtime of a freshly touched file)."""
+    clock = os.path.join(queue, 'clock.' + socket.gethostname() + '.' + str(os.getpid()))
+    with open(clock, 'a'):
+        os.utime(clock, None)
+    return os.stat(clock).st_mtime
+
+
+def claim(queue, token=None):
+    """Claim the next pending job for the owner token, returns (file name, job) or None if
+    none is pending."""
+    token = token or owner_token()
+    for name in job_files(queue, 'pending'):
+        pending = os.path.join(queue, 'pending', name)
+        claimed = os.path.join(queue, 'claimed', claimed_name(name, token))
+        try:
+            os.utime(pending, None) # fresh lease before the file becomes visible in claimed/
+            os.rename(pending, claimed)
+        except FileNotFoundError: # another worker was faster
+            continue
+        return name, read_json(claimed)
+    return None
+
+
+def reclaim(queue, lease=lease, max_attempts=max_attempts):
+    """Return claimed jobs with an expired lease to pending/ (or failed/), returns their names."""
+    now = server_time(queue)
+    reclaimed = []
+    for owned in job_files(queue, 'claimed'):
+        claimed = os.path.join(queue, 'claimed', owned)
+        name = job_name(owned)
+        try:
+            if now - os.stat(claimed).st_mtime < lease:
+                continue
+            job = read_json(claimed)
+            # take the file away first, so only one worker reclaims it; the owner's heartbeat
+            # then finds its file gone and the owner knows it lost the lease
+            stale = os.path.join(queue, 'claimed', owned[:-5] + '.stale.' + owner_token())
+            os.rename(claimed, stale)
+        except (FileNotFoundError, ValueError): # reclaimed by another worker meanwhile
+            continue
+        job['attempts'] = job.get('attempts', 0) + 1
+        job.setdefault('expired', []).append(owned[:-5].rsplit('@', 1)[1]) # owner token
+        state = 'failed' if job['attempts'] >= max_attempts else 'pending'
+        if state == 'failed':
+            job['error'] = 'lease expired ' + str(job['attempts']) + ' times'
+        write_json(os.path.join(queue, state, name), job)
+        os.remove(stale)
+        reclaimed.append(name)
+    return reclaimed
+
+
+class Heartbeat(threading.Thread):
+    """Touch the claimed job file of this worker every 'interval' seconds until stopped or
+    the lease is lost (file gone, i.e. reclaimed by another worker)."""
+
+    def __init__(self, filename, interval=heartbeat):
+        threading.Thread.__init__(self, daemon=True)
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.filename, None)
+            except FileNotFoundError: # reclaimed by another worker
+                self.lost = True
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(queue, name, job, worker, workroot=workroot, heartbeat=heartbeat, token=None):
+    """Run a job claimed with the owner token, with heartbeat, in <workroot>/<job>@<token>.
+
+    Returns the state written ('done' or 'failed'), or 'lost' if the lease expired meanwhile:
+    then another worker has the job and nothing is written or removed in the queue.
+    """
+    token = token or owner_token()
+    claimed = os.path.join(queue, 'claimed', claimed_name(name, token))
+    job['worker'] = worker
+    job['started'] = datetime.now().isoformat()
+    beat = Heartbeat(claimed, heartbeat)
+    beat.start()
+    starttime = datetime.now() # start stopwatch
+    workdir = os.path.join(workroot, claimed_name(name, token)[:-5])
+    try:
+        os.makedirs(workdir, exist_ok=True)
+        function = importlib.import_module(job['module']).process_member
+        message = function(*job['args'], workdir=workdir)
+        state = 'done'
+        job['message'] = message
+    except Exception:
+        state = 'failed'
+        job['error'] = traceback.format_exc()
+        job['workdir'] = socket.gethostname() + ':' + workdir # kept for inspection
+    finally:
+        beat.stop()
+    job['duration'] = str(datetime.now() - starttime)
+
+    # take our claimed file out of claimed/ before writing the result, so it cannot be
+    # reclaimed in between; if it is gone already the lease was lost
+    finishing = claimed[:-5] + '.finishing'
+    try:
+        os.rename(claimed, finishing)
+    except FileNotFoundError:
+        return 'lost'
+    write_json(os.path.join(queue, state, name), job)
+    os.remove(finishing)
+    if state == 'done':
+        shutil.rmtree(workdir, ignore_errors=True)
+    return state
+
+
+def work(queue, workroot=workroot, lease=lease, heartbeat=heartbeat, poll=poll,
+         max_attempts=max_attempts):
+    """Worker loop: claim and run jobs until no job is pending or claimed any more."""
+    worker = socket.gethostname() + ':' + str(os.getpid())
+    token = owner_token()
+    n = 0
+    while True:
+        reclaim(queue, lease, max_attempts)
+        claimed = claim(queue, token)
+        if claimed is None:
+            if not job_files(queue, 'claimed'):
+                return n
+            time.sleep(poll) # others are still running, their jobs may come back
+            continue
+        name, job = claimed
+        state = run_job(queue, name, job, worker, workroot, heartbeat, token)
+        print(worker + ': ' + name[:-5] + ' ' + state)
+        n += 1
+
+
+def status(queue):
+    """Number of jobs in every state."""
+    return {state: len(job_files(queue, state)) for state in states}
+
+
+def work_parallel(queue, n_workers, **kwargs):
+    """Start n_workers worker processes on this node and wait for them."""
+    processes = [multiprocessing.Process(target=work, args=(queue,), kwargs=kwargs)
+                 for _ in range(n_workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+def process_member(name, seconds, workdir):
+    """Test job of the demo: wait and write a file into the working directory."""
+    with open(os.path.join(workdir, name + '.txt'), 'w') as f:
+        f.write(name)
+    time.sleep(seconds)
+
+
+def demo(n_workers=4, n_jobs=12):
+    """Local test: workers in processes on a queue in a temporary directory; one worker is
+    killed during its job and the job must be taken over by the others."""
+    with tempfile.TemporaryDirectory() as queue:
+        submit(queue, 'work_queue', [('job%02d' % i, 0.5) for i in range(n_jobs)])
+        options = {'lease': 2., 'heartbeat': 0.2, 'poll': 0.2}
+        victim = multiprocessing.Process(target=work, args=(queue,), kwargs=options)
+        victim.start()
+        while not job_files(queue, 'claimed'): # kill the worker while it runs a job
+            time.sleep(0.05)
+        victim.kill()
+        victim.join()
+        work_parallel(queue, n_workers, **options)
+        result = status(queue)
+        print(result)
+        retried = [n for n in job_files(queue, 'done')
+                   if read_json(os.path.join(queue, 'done', n)).get('attempts', 0) > 0]
+        print('taken over from the killed worker: ' + ', '.join(retried))
+        return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('submit', 'work', 'status', 'demo'):
+        sys.exit('usage: python work_queue.py submit QUEUE MODULE | work QUEUE [n_workers] | '
+                 'status QUEUE | demo [n_workers]')
+    command = sys.argv[1]
+    starttime = datetime.now() # start stopwatch
+    if command == 'submit':
+        module = sys.argv[3]
+        n = submit(sys.argv[2], module, importlib.import_module(module).job_list)
+        print(str(n) + ' jobs submitted')
+    elif command == 'work':
+        n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        work_parallel(sys.argv[2], n_workers)
+    elif command == 'status':
+        print(status(sys.argv[2]))
+    else:
+        demo(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    print(datetime.now() - starttime)
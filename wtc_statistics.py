@@ -0,0 +1,116 @@
+# Purpose: Statistics of all classifications of the MeteoSwiss WTC file in one scan, instead of
+#          rerunning the R scripts once per classification (wkwtg1d0, wkwtp1d0, ...)
+#          (1) parse data/WTC_MCH_19570901-20180831.dat once (cost_parser.py)
+#          (2) treat the classification columns as members of one matrix, so frequency.py and
+#              persistence.py count all of them in the same vectorized call
+#          (3) every classification keeps its own number of classes, taken from its column
+#              (e.g. 10 for wkwtg1d0, 27 for wkcap3d0), the results are cut to that size
+#          (4) per classification: seasonal frequency (days per year and %), run-length
+#              histogram (Fig. 1) and the linear trend of the annual seasonal counts
+#              (Figs. S3-S7), all for the past period 1988-2017
+#          usage: python wtc_statistics.py [WTC file] [output.npz] [output.txt]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+#                                                                                               #
+# Project:  Practicum MeteoSwiss/ETH Zurich                                                     #
+#           Frequency and Persistence of Central European Circulation Types                     #
+#                                                                                               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+# preamble
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+import os
+import sys
+from datetime import datetime # package for stopping time
+import numpy as np # package for calculations
+import cost_parser # chunked parser for the text files
+import frequency
+import persistence
+import trends
+from calendar_conversion import seasons
+from cost_parser import missing # uint8 sentinel for NaN, i.e. 255
+from date_index import path_data, periods
+
+wtc_file = os.path.join(path_data, 'WTC_MCH_19570901-20180831.dat')
+trend_years = (1960, 2017) # yearly bins of the reanalysis in FigsS3-S7_time_series_and_trends.R
+
+
+def class_counts(types):
+    """Number of classes of every column, i.e. its largest type (NaN days left out)."""
+    valid = np.where(types == missing, 0, types)
+    return valid.max(axis=0).astype(int)
+
+
+def statistics(dates, types, names, years=periods['past'], max_length=None,
+               calendar='gregorian'):
+    """Frequency, persistence and trends of every classification column of a WTC matrix.
+
+    Returns a dict {classification: dict of arrays} with
+        n_types   -> number of classes
+        counts    -> days per (season, type) in the period
+        frequency -> days per year (season, type)
+        relative  -> % of the valid days of the season (season, type)
+        runs      -> run-length histogram (type, season, length), shared length axis
+        trend     -> slope of the annual counts (season, type) in days per year
+        trend_pvalue -> two-sided p-value of the slope
+    """
+    n_types = class_counts(types)
+    n_max = int(n_types.max(initial=0))
+
+    # one vectorized pass over all columns with the largest number of classes
+    freq = frequency.frequencies(types, dates, n_max, years=(years,))
+    runs = persistence.period_histograms(types, dates, n_max, max_length, calendar,
+                                         years=(years,))[0]
+    annual, annual_years = frequency.annual_counts(types, dates, n_max, trend_years)
+    trend = trends.trends(annual, annual_years, years, robust=False)
+
+    result = {}
+    for i, name in enumerate(names):
+        n = n_types[i]
+        result[name] = {'n_types': n,
+                        'counts': freq['counts'][0, i, :, :n],
+                        'frequency': freq['mean_annual'][0, i, :, :n],
+                        'relative': freq['relative'][0, i, :, :n],
+                        'runs': runs[i, :n],
+                        'trend': trend['slope'][i, :, :n],
+                        'trend_pvalue': trend['pvalue'][i, :, :n]}
+    return result
+
+
+def statistics_file(filename=wtc_file, **kwargs):
+    """statistics() of all classifications of a WTC file, parsed once."""
+    dates, types, names = cost_parser.read(filename)
+    return statistics(dates, types, names, **kwargs)
+
+
+def save(result, filename):
+    """Store all classifications in one npz file, arrays named '<classification>_<statistic>'."""
+    arrays = {}
+    for name, stats in result.items():
+        for key, value in stats.items():
+            arrays[name + '_' + key] = value
+    np.savez(filename, classifications=list(result), **arrays)
+
+
+def write_table(result, filename):
+    """Write frequency and trend of all classifications as a long table for R (read.table)."""
+    with open(filename, 'w') as f:
+        f.write('classification season type frequency relative trend\n')
+        for name, stats in result.items():
+            for s, t in np.ndindex(*stats['frequency'].shape):
+                f.write('%s %s %d %.6g %.6g %.6g\n' % (
+                    name, seasons[s], t + 1, stats['frequency'][s, t],
+                    stats['relative'][s, t], stats['trend'][s, t]))
+
+
+if __name__ == '__main__':
+    starttime = datetime.now() # start stopwatch
+    filename = sys.argv[1] if len(sys.argv) > 1 else wtc_file
+    output = sys.argv[2] if len(sys.argv) > 2 else 'wtc_statistics.npz'
+    result = statistics_file(filename)
+    save(result, output)
+    if len(sys.argv) > 3:
+        write_table(result, sys.argv[3])
+    for name, stats in result.items():
+        print(name + ': ' + str(stats['n_types']) + ' classes')
+    print(datetime.now() - starttime)